@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - 客户特征构建
+
+流失预测和客户行为预测使用的客户特征（days_since_last_order、order_frequency、
+avg_order_value、total_spent、payment_delay_avg、days_since_last_contact等）
+由数据库用集合聚合SQL计算，不再由调用方逐个客户计算：
+
+- 按客户汇总 orders、payments、tracking_records（target_type=2，客户跟踪记录）
+- 汇总结果物化到 ai_customer_features 表，只保存与当前时间无关的聚合值
+  （订单数、累计金额、最近下单时间等），"距今天数"类特征在读取时计算
+- 增量刷新：只重新汇总 updated_at 晚于上次刷新时间的客户、订单、支付和跟踪记录
+  涉及的客户；刷新时间记录在 ai_feature_refresh_state 表中
+- 多个进程同时刷新时用事务级advisory lock串行化
+- 两张表的结构定义在 DB_Design/database_design.sql（7. AI特征相关表），服务运行时不执行DDL
+
+读取查询输出的列与 ChurnPredictor._prepare_churn_features 和
+CustomerBehaviorPredictor.prepare_features 使用的列一致，另含训练目标列
+customer_value 和 is_churned。
+"""
+
+import os
+import time
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Sequence, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FEATURE_TABLE = 'ai_customer_features'
+FEATURE_STATE_TABLE = 'ai_feature_refresh_state'
+
+# 增量刷新时向前多取的秒数：覆盖刷新期间尚未提交、提交后updated_at早于刷新时间的记录
+FEATURE_REFRESH_OVERLAP = int(os.getenv('FEATURE_REFRESH_OVERLAP', 300))
+
+# 特征刷新的advisory lock键
+FEATURE_REFRESH_LOCK_ID = 724300118
+
+# ================================================================================
+# 刷新
+# ================================================================================
+
+# 需要重新汇总的客户：全量刷新为所有正常客户，增量刷新为相关记录有更新的客户
+FULL_TARGET_SQL = "SELECT id AS customer_id FROM customers WHERE status = 1"
+CHANGED_TARGET_SQL = """
+    SELECT id AS customer_id FROM customers WHERE updated_at > %(since)s
+    UNION
+    SELECT customer_id FROM orders WHERE updated_at > %(since)s
+    UNION
+    SELECT o.customer_id FROM payments p JOIN orders o ON o.id = p.order_id WHERE p.updated_at > %(since)s
+    UNION
+    SELECT target_id FROM tracking_records WHERE target_type = 2 AND updated_at > %(since)s
+"""
+
+UPSERT_FEATURES_SQL = f"""
+    WITH target AS ({{target}}),
+    order_stats AS (
+        SELECT customer_id,
+               COUNT(*) AS order_count,
+               SUM(total_amount) AS total_spent,
+               AVG(total_amount) AS avg_order_value,
+               MAX(order_date) AS last_order_date
+        FROM orders
+        WHERE status = 1 AND order_status <> 6
+          AND customer_id IN (SELECT customer_id FROM target)
+        GROUP BY customer_id
+    ), payment_stats AS (
+        SELECT o.customer_id,
+               AVG(EXTRACT(EPOCH FROM (p.payment_time - o.order_date)) / 86400) AS payment_delay_avg
+        FROM payments p
+        JOIN orders o ON o.id = p.order_id
+        WHERE p.payment_status = 1 AND o.status = 1
+          AND o.customer_id IN (SELECT customer_id FROM target)
+        GROUP BY o.customer_id
+    ), contact_stats AS (
+        SELECT target_id AS customer_id,
+               COUNT(*) AS contact_count,
+               MAX(created_at) AS last_contact_date
+        FROM tracking_records
+        WHERE target_type = 2
+          AND target_id IN (SELECT customer_id FROM target)
+        GROUP BY target_id
+    )
+    INSERT INTO {FEATURE_TABLE} (
+        customer_id, customer_created_at, business_type, source_channel, customer_level, customer_status,
+        order_count, total_spent, avg_order_value, last_order_date, payment_delay_avg,
+        contact_count, last_contact_date, refreshed_at
+    )
+    SELECT c.id, c.created_at, c.business_type, c.source_channel, c.customer_level, c.customer_status,
+           COALESCE(os.order_count, 0), COALESCE(os.total_spent, 0), os.avg_order_value, os.last_order_date,
+           ps.payment_delay_avg, COALESCE(cs.contact_count, 0), cs.last_contact_date, now()
+    FROM customers c
+    LEFT JOIN order_stats os ON os.customer_id = c.id
+    LEFT JOIN payment_stats ps ON ps.customer_id = c.id
+    LEFT JOIN contact_stats cs ON cs.customer_id = c.id
+    WHERE c.status = 1
+      AND c.id IN (SELECT customer_id FROM target)
+    ON CONFLICT (customer_id) DO UPDATE SET
+        customer_created_at = EXCLUDED.customer_created_at,
+        business_type = EXCLUDED.business_type,
+        source_channel = EXCLUDED.source_channel,
+        customer_level = EXCLUDED.customer_level,
+        customer_status = EXCLUDED.customer_status,
+        order_count = EXCLUDED.order_count,
+        total_spent = EXCLUDED.total_spent,
+        avg_order_value = EXCLUDED.avg_order_value,
+        last_order_date = EXCLUDED.last_order_date,
+        payment_delay_avg = EXCLUDED.payment_delay_avg,
+        contact_count = EXCLUDED.contact_count,
+        last_contact_date = EXCLUDED.last_contact_date,
+        refreshed_at = EXCLUDED.refreshed_at
+"""
+
+# 删除已删除（status=0）或已不存在的客户
+DELETE_STALE_SQL = f"""
+    DELETE FROM {FEATURE_TABLE} f
+    WHERE NOT EXISTS (SELECT 1 FROM customers c WHERE c.id = f.customer_id AND c.status = 1)
+"""
+
+
+def refresh_customer_features(connection, full: bool = False) -> Dict[str, Any]:
+    """刷新客户特征表：首次或full为True时全量刷新，否则只刷新有更新的客户"""
+    start = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (FEATURE_REFRESH_LOCK_ID,))
+            # 拿到锁之后再取刷新时间和上次刷新时间，避免并发刷新互相覆盖
+            cursor.execute("SELECT clock_timestamp()::timestamp")
+            refreshed_at = cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT last_refreshed_at FROM {FEATURE_STATE_TABLE} WHERE feature_table = %s",
+                (FEATURE_TABLE,)
+            )
+            row = cursor.fetchone()
+            since = None if full or row is None else row[0] - timedelta(seconds=FEATURE_REFRESH_OVERLAP)
+
+            if since is None:
+                cursor.execute(UPSERT_FEATURES_SQL.format(target=FULL_TARGET_SQL))
+            else:
+                cursor.execute(UPSERT_FEATURES_SQL.format(target=CHANGED_TARGET_SQL), {'since': since})
+            upserted = cursor.rowcount
+            cursor.execute(DELETE_STALE_SQL)
+            deleted = cursor.rowcount
+
+            cursor.execute(
+                f"""INSERT INTO {FEATURE_STATE_TABLE} (feature_table, last_refreshed_at) VALUES (%s, %s)
+                    ON CONFLICT (feature_table) DO UPDATE SET last_refreshed_at = EXCLUDED.last_refreshed_at""",
+                (FEATURE_TABLE, refreshed_at)
+            )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    result = {
+        'mode': 'full' if since is None else 'incremental',
+        'since': since.isoformat() if since is not None else None,
+        'upserted': upserted,
+        'deleted': deleted,
+        'refreshed_at': refreshed_at.isoformat(),
+        'duration_seconds': time.perf_counter() - start
+    }
+    logger.info(f"客户特征刷新完成: {result}")
+    return result
+
+# ================================================================================
+# 读取
+# ================================================================================
+
+# 读取时计算与当前时间相关的特征；客户创建不足30天的按30天计算频率
+CUSTOMER_FEATURES_SQL = f"""
+    SELECT customer_id,
+           (EXTRACT(EPOCH FROM (now() - last_order_date)) / 86400)::float8 AS days_since_last_order,
+           (order_count / GREATEST(EXTRACT(EPOCH FROM (now() - customer_created_at)) / 86400 / 30, 1))::float8
+               AS order_frequency,
+           avg_order_value::float8 AS avg_order_value,
+           total_spent::float8 AS total_spent,
+           (contact_count / GREATEST(EXTRACT(EPOCH FROM (now() - customer_created_at)) / 86400 / 30, 1))::float8
+               AS interaction_frequency,
+           (EXTRACT(EPOCH FROM (now() - last_contact_date)) / 86400)::float8 AS days_since_last_contact,
+           0::float8 AS support_ticket_count,  -- 系统暂无工单表
+           payment_delay_avg::float8 AS payment_delay,
+           payment_delay_avg::float8 AS payment_delay_avg,
+           (EXTRACT(EPOCH FROM (now() - customer_created_at)) / 86400)::float8 AS customer_age_days,
+           business_type,
+           source_channel,
+           COALESCE(customer_level, 1)::int8 AS customer_level,
+           total_spent::float8 AS customer_value,
+           COALESCE(customer_status = 4, false)::int8 AS is_churned  -- customer_status可为NULL
+    FROM {FEATURE_TABLE}
+"""
+CUSTOMER_FEATURES_BY_ID_SQL = CUSTOMER_FEATURES_SQL + " WHERE customer_id = ANY(%(customer_ids)s)"
+
+# 列定义: (列名, NumPy类型)，顺序与CUSTOMER_FEATURES_SQL一致
+CUSTOMER_FEATURES_COLUMNS: Sequence[Tuple[str, str]] = [
+    ('customer_id', 'int64'), ('days_since_last_order', 'float64'), ('order_frequency', 'float64'),
+    ('avg_order_value', 'float64'), ('total_spent', 'float64'), ('interaction_frequency', 'float64'),
+    ('days_since_last_contact', 'float64'), ('support_ticket_count', 'float64'), ('payment_delay', 'float64'),
+    ('payment_delay_avg', 'float64'), ('customer_age_days', 'float64'), ('business_type', 'object'),
+    ('source_channel', 'object'), ('customer_level', 'int64'), ('customer_value', 'float64'),
+    ('is_churned', 'int64'),
+]
+
+
+def load_customer_features(connection, customer_ids: List[int]) -> pd.DataFrame:
+    """按客户ID读取特征（预测用），行顺序与customer_ids一致，不存在的客户不返回"""
+    customer_ids = [int(i) for i in customer_ids]
+    with connection.cursor() as cursor:
+        cursor.execute(CUSTOMER_FEATURES_BY_ID_SQL, {'customer_ids': customer_ids})
+        rows = cursor.fetchall()
+    connection.rollback()
+
+    df = pd.DataFrame.from_records(rows, columns=[name for name, _ in CUSTOMER_FEATURES_COLUMNS])
+    df = df.astype(dict(CUSTOMER_FEATURES_COLUMNS))
+
+    # 数据库按任意顺序返回，按请求的ID重排（customer_id为主键，不会重复）
+    positions = pd.Index(df['customer_id']).get_indexer(customer_ids)
+    return df.take(positions[positions >= 0]).reset_index(drop=True)
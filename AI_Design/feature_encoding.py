@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - 特征编码
+
+客户行为预测和流失预测的特征变换（FeaturePipeline）在训练时拟合，随模型一起保存，
+预测时只做查表和向量化运算，不再依赖请求数据本身的统计量：
+
+- 数值特征的缺失值用训练数据的中位数填充（单条预测时请求内的中位数本身就是缺失值），
+  请求中缺少的数值列整列按缺失处理
+- 分类特征（business_type、source_channel、customer_level）在训练时建立词表，
+  已知类别的编码与sklearn LabelEncoder相同（排序后的下标）；训练时未出现过的类别
+  统一编码为OOV桶（词表大小），不再抛出异常，批量预测不会因为个别新类别整批失败
+- 分类值整列去重后转为字符串查表，与整列的dtype无关：整数列中出现缺失值时pandas会把整列
+  转为float，3.0仍按'3'查找；缺失值编码为固定的缺失编码（词表大小 + 1），
+  同一客户单独预测和与其他客户一起批量预测时编码相同
+- 输出固定列顺序的float64矩阵，可直接交给StandardScaler
+
+旧版本模型没有保存特征变换时，由保存的LabelEncoder和StandardScaler（拟合时的列名和均值）
+构造对应的变换：分类编码不变，缺失值按训练均值填充，无需重新训练。
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class CategoricalVocabulary:
+    """训练时建立的分类值词表，带OOV桶"""
+
+    def __init__(self, categories: Iterable[str]):
+        self.categories = np.asarray(categories, dtype=object)
+        self._index = pd.Index(self.categories)
+
+    @classmethod
+    def fit(cls, values: Any) -> 'CategoricalVocabulary':
+        """按训练数据建立词表（类别排序方式与LabelEncoder一致，缺失值不进入词表）"""
+        _, keys = factorize_keys(values)
+        return cls(np.unique(keys.astype(str)))
+
+    @classmethod
+    def from_label_encoder(cls, encoder: Any) -> 'CategoricalVocabulary':
+        """由旧模型保存的LabelEncoder转换，编码结果不变"""
+        return cls(encoder.classes_)
+
+    @property
+    def oov_code(self) -> int:
+        """未知类别的编码"""
+        return len(self.categories)
+
+    @property
+    def missing_code(self) -> int:
+        """缺失值的编码"""
+        return len(self.categories) + 1
+
+    def encode(self, values: Any) -> np.ndarray:
+        """整列编码，未知类别编码为oov_code，缺失值编码为missing_code"""
+        positions, keys = factorize_keys(values)
+        codes = self._index.get_indexer(keys)
+        codes[codes < 0] = self.oov_code
+        return np.append(codes, self.missing_code)[positions]
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def __getstate__(self):
+        return {'categories': self.categories}
+
+    def __setstate__(self, state):
+        self.__init__(state['categories'])
+
+
+def category_keys(values: Any) -> np.ndarray:
+    """把整列分类值转为查表用的字符串，缺失值为None"""
+    positions, keys = factorize_keys(values)
+    return np.append(keys, None)[positions]
+
+
+def factorize_keys(values: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """整列去重后只对不同的值转字符串：返回 (每行在keys中的位置, 不同值的字符串)，缺失值的位置为-1
+
+    整数值的浮点数（3.0）按整数（'3'）处理，结果不取决于整列的dtype。
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    positions, uniques = pd.factorize(series, use_na_sentinel=True)
+    uniques = pd.Series(uniques)
+    if uniques.dtype == object and pd.api.types.infer_dtype(uniques, skipna=True) in ('integer', 'floating', 'mixed-integer-float'):
+        # 数值以Python对象存放时（如与None混在一起）按浮点列处理
+        uniques = uniques.astype(np.float64)
+
+    keys = uniques.astype(str).to_numpy(dtype=object)
+    if uniques.dtype.kind == 'f':
+        with np.errstate(invalid='ignore'):
+            integral = np.equal(np.mod(uniques.to_numpy(), 1), 0)
+        keys[integral] = uniques[integral].astype('Int64').astype(str).to_numpy(dtype=object)
+    return positions, keys
+
+
+class FeaturePipeline:
+    """训练时拟合的特征变换：数值列缺失值填充 + 分类列词表编码"""
+
+    def __init__(self, numeric_columns: Sequence[str], fill_values: Sequence[float],
+                 vocabularies: Dict[str, CategoricalVocabulary]):
+        self.numeric_columns = list(numeric_columns)
+        self.fill_values = np.asarray(fill_values, dtype=np.float64)
+        self.vocabularies = dict(vocabularies)
+
+    @property
+    def feature_columns(self) -> List[str]:
+        """输出矩阵的列名：数值列在前，分类列编码在后"""
+        return self.numeric_columns + [f'{column}_encoded' for column in self.vocabularies]
+
+    @classmethod
+    def fit(cls, df: pd.DataFrame, numeric_columns: Sequence[str],
+            categorical_columns: Sequence[str]) -> 'FeaturePipeline':
+        """按训练数据拟合，只使用训练数据中存在的列；全部缺失的数值列按0填充"""
+        numeric_columns = [column for column in numeric_columns if column in df.columns]
+        with np.errstate(all='ignore'):
+            medians = df[numeric_columns].astype(np.float64).median().to_numpy()
+        vocabularies = {
+            column: CategoricalVocabulary.fit(df[column])
+            for column in categorical_columns if column in df.columns
+        }
+        return cls(numeric_columns, np.nan_to_num(medians, nan=0.0), vocabularies)
+
+    @classmethod
+    def from_legacy(cls, scaler: Any, vocabularies: Dict[str, CategoricalVocabulary],
+                    feature_columns: Optional[Sequence[str]] = None) -> 'FeaturePipeline':
+        """由旧版本模型构造：列来自缩放器拟合时的列名，缺失值按训练均值（StandardScaler.mean_）填充"""
+        columns = list(getattr(scaler, 'feature_names_in_', feature_columns))
+        numeric = [(column, mean) for column, mean in zip(columns, scaler.mean_) if not column.endswith('_encoded')]
+        return cls(
+            [column for column, _ in numeric],
+            [mean for _, mean in numeric],
+            {column[:-len('_encoded')]: vocabularies[column[:-len('_encoded')]]
+             for column in columns if column.endswith('_encoded')}
+        )
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        """变换为 (样本数, 特征数) 的float64矩阵"""
+        X = np.empty((len(df), len(self.numeric_columns) + len(self.vocabularies)), dtype=np.float64)
+        n_numeric = len(self.numeric_columns)
+
+        numeric = X[:, :n_numeric]
+        numeric[:] = df.reindex(columns=self.numeric_columns).to_numpy(dtype=np.float64, na_value=np.nan)
+        np.copyto(numeric, self.fill_values, where=np.isnan(numeric))
+
+        for j, (column, vocabulary) in enumerate(self.vocabularies.items(), start=n_numeric):
+            X[:, j] = vocabulary.encode(df[column]) if column in df.columns else vocabulary.missing_code
+        return X
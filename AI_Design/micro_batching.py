@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - 单条预测请求的微批处理
+
+Java服务按客户逐个调用 /models/churn/predict 和 /models/customer_behavior/predict，
+每个请求单独做一次特征预处理和一次predict_proba/predict，Python和sklearn的固定开销
+远大于单行计算本身。MicroBatcher在服务端把并发到达的单条请求合并：
+
+- 请求线程提交后阻塞等待自己的结果，接口和响应格式不变
+- 收集线程拿到第一条请求后最多再等待 max_wait_ms 毫秒或凑满 max_batch_size 条，
+  整批交给 process_batch 做一次向量化预测，再把结果逐条交还各自的请求线程
+- 同时处理的批次数不超过 max_concurrency；批次都在处理时新请求继续排队，
+  下一批自然变大，负载越高合并越多，空闲时单条请求最多多等待 max_wait_ms
+- max_batch_size 不大于1时不合并，直接在请求线程中处理
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """把并发的单条请求合并为批量调用"""
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 64,
+                 max_wait_ms: float = 5.0, max_concurrency: int = 1, name: str = 'micro-batcher'):
+        """
+        process_batch: 接收一批请求，按相同顺序返回每条请求的结果
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrency = max(1, max_concurrency)
+        self.name = name
+        self._queue: Optional[queue.Queue] = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'batches': 0, 'max_batch_size_seen': 0}
+
+    def submit(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """提交一条请求并等待其结果（process_batch抛出的异常在这里重新抛出）"""
+        if self.max_batch_size <= 1:
+            return self.process_batch([item])[0]
+        future = Future()
+        self._ensure_started().put((item, future))
+        return future.result(timeout)
+
+    def _ensure_started(self) -> queue.Queue:
+        """在当前进程中启动收集线程（fork出的工作进程不继承父进程的线程，按进程ID检查）"""
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._collect, args=(self._queue,), name=self.name, daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _collect(self, requests: queue.Queue) -> None:
+        """收集线程：组批并交给处理线程，处理中的批次达到上限时等待"""
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=self.name)
+        slots = threading.Semaphore(self.max_concurrency)
+        while True:
+            slots.acquire()
+            batch = [requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait())
+                except queue.Empty:
+                    break
+            executor.submit(self._dispatch, batch, slots)
+
+    def _dispatch(self, batch: List[tuple], slots: threading.Semaphore) -> None:
+        """处理一批请求并把结果分发给各请求线程"""
+        try:
+            with self._stats_lock:
+                self.stats['requests'] += len(batch)
+                self.stats['batches'] += 1
+                self.stats['max_batch_size_seen'] = max(self.stats['max_batch_size_seen'], len(batch))
+            try:
+                results = self.process_batch([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"批处理结果数量不一致: {len(results)} != {len(batch)}")
+            except Exception as e:
+                logger.error(f"微批处理失败 [{self.name}]: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        finally:
+            slots.release()
+
+    def status(self) -> Dict[str, Any]:
+        """配置和合并统计"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['avg_batch_size'] = stats['requests'] / stats['batches'] if stats['batches'] else 0.0
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'max_concurrency': self.max_concurrency,
+            **stats
+        }
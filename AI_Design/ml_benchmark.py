@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - Python ML服务性能基准测试
+
+测试内容：
+1. model_loading: 模型冷加载耗时和每个工作进程的内存占用（普通反序列化 vs 内存映射）
+2. training: RandomForest / XGBoost 在不同线程数下的训练耗时与加速比
+3. sales_forecast: 销售趋势预测 fast / full 两种区间计算方式的延迟
+4. sales_series: 多序列销售预测在不同进程数下的训练耗时与加速比
+5. payload_format: 批量流失预测请求体 JSON vs Arrow / npz 的解码耗时和端到端延迟
+6. micro_batching: 并发单条流失预测请求在微批处理关闭/开启时的吞吐量和延迟
+7. tree_inference: 随机森林（流失预测、销售趋势）sklearn预测 vs 导出节点数组的NumPy遍历
+
+运行方式:
+python ml_benchmark.py model_loading --workers 4
+python ml_benchmark.py model_loading --workers 4 --prepare 200000
+python ml_benchmark.py training --rows 50000 --threads 1 2 4 8
+python ml_benchmark.py sales_forecast --months 24 120 --periods 3 12 36
+python ml_benchmark.py sales_series --series 64 --workers 1 2 4 8
+python ml_benchmark.py payload_format --rows 100000
+python ml_benchmark.py micro_batching --concurrency 1 8 32 --requests 2000
+python ml_benchmark.py tree_inference --rows 1 100 10000
+
+除不带 --prepare 的 model_loading（读取MODEL_PATH下的现有模型）外，基准训练的模型都发布到
+临时目录，运行结束后删除。
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+import multiprocessing as mp
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+import joblib
+import psutil
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MODEL_NAMES = [
+    'sales_trend_model', 'customer_behavior_model',
+    'churn_prediction_model', 'recommendation_model'
+]
+
+# ================================================================================
+# 工具函数
+# ================================================================================
+
+def _touch_arrays(obj: Any, seen: Optional[set] = None) -> int:
+    """遍历对象中的NumPy数组并读取全部数据，确保内存映射的页面真正被加载"""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind in 'biuf' and obj.size:
+            obj.sum()
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(_touch_arrays(v, seen) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_touch_arrays(v, seen) for v in obj)
+    if hasattr(obj, '__dict__'):
+        return _touch_arrays(vars(obj), seen)
+    return 0
+
+def _memory_info() -> Dict[str, float]:
+    """当前进程的RSS和PSS（MB），PSS按共享进程数分摊共享页"""
+    info = psutil.Process().memory_full_info()
+    return {
+        'rss_mb': info.rss / 1024 / 1024,
+        'pss_mb': getattr(info, 'pss', info.rss) / 1024 / 1024
+    }
+
+def print_table(title: str, rows: List[Dict[str, Any]]) -> None:
+    """打印结果表格"""
+    logger.info("=" * 60)
+    logger.info(title)
+    logger.info("=" * 60)
+    if not rows:
+        return
+    columns = list(rows[0])
+    logger.info("  ".join(f"{c:>18}" for c in columns))
+    for row in rows:
+        logger.info("  ".join(
+            f"{v:>18.2f}" if isinstance(v, float) else f"{str(v):>18}" for v in row.values()
+        ))
+
+# ================================================================================
+# 模型加载基准
+# ================================================================================
+
+def _loading_worker(model_file: str, mmap_mode: Optional[str], barrier, results) -> None:
+    """工作进程：冷加载模型并报告耗时与内存"""
+    # 先导入模型依赖的库，使计时和内存统计只反映模型数据本身
+    import scipy.sparse, sklearn.ensemble, sklearn.decomposition, xgboost, prophet  # noqa: F401
+    baseline = _memory_info()
+    start = time.perf_counter()
+    model = joblib.load(model_file, mmap_mode=mmap_mode)
+    load_time = time.perf_counter() - start
+    array_bytes = _touch_arrays(model)
+
+    # 等所有工作进程都持有模型后再测量，使共享页在PSS中体现
+    barrier.wait()
+    memory = _memory_info()
+    results.put({
+        'load_ms': load_time * 1000,
+        'rss_mb': memory['rss_mb'] - baseline['rss_mb'],
+        'pss_mb': memory['pss_mb'] - baseline['pss_mb'],
+        'array_mb': array_bytes / 1024 / 1024
+    })
+    barrier.wait()
+
+def benchmark_model_loading(workers: int, model_names: List[str]) -> List[Dict[str, Any]]:
+    """比较普通反序列化和内存映射两种加载方式"""
+    from python_ml_service import resolve_model_dir
+
+    ctx = mp.get_context('spawn')
+    rows = []
+
+    for model_name in model_names:
+        model_file = os.path.join(resolve_model_dir(model_name), f"{model_name}.pkl")
+        if not os.path.exists(model_file):
+            logger.warning(f"模型文件不存在，跳过: {model_file}")
+            continue
+
+        for mmap_mode in (None, 'r'):
+            barrier = ctx.Barrier(workers)
+            results = ctx.Queue()
+            processes = [
+                ctx.Process(target=_loading_worker, args=(model_file, mmap_mode, barrier, results))
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            samples = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+
+            rows.append({
+                'model': model_name,
+                'mode': 'mmap' if mmap_mode else 'pickle',
+                'load_ms': float(np.mean([s['load_ms'] for s in samples])),
+                'rss_mb/worker': float(np.mean([s['rss_mb'] for s in samples])),
+                'pss_mb/worker': float(np.mean([s['pss_mb'] for s in samples])),
+                'arrays_mb': float(samples[0]['array_mb'])
+            })
+
+    return rows
+
+def prepare_models(n_customers: int) -> None:
+    """用模拟数据训练较大规模的推荐和流失模型，供加载基准使用"""
+    from python_ml_service import RecommendationEngine, ChurnPredictor
+    from ai_integration_test import AIIntegrationTester
+
+    rng = np.random.default_rng(42)
+    n_products = max(100, n_customers // 100)
+    n_interactions = n_customers * 5
+    interactions = [
+        {'customer_id': int(c), 'product_id': int(p), 'rating': int(r)}
+        for c, p, r in zip(
+            rng.integers(0, n_customers, n_interactions),
+            rng.integers(0, n_products, n_interactions),
+            rng.integers(1, 6, n_interactions)
+        )
+    ]
+    logger.info(f"训练推荐模型: {n_customers}个客户 x {n_products}个产品")
+    RecommendationEngine().train(interactions)
+
+    tester = AIIntegrationTester()
+    churn_data = [row for _ in range(max(1, n_customers // 10000)) for row in tester.generate_churn_data()]
+    logger.info(f"训练流失模型: {len(churn_data)}条样本")
+    ChurnPredictor().train(churn_data)
+
+# ================================================================================
+# 多核训练基准
+# ================================================================================
+
+def benchmark_training(n_rows: int, thread_counts: List[int]) -> List[Dict[str, Any]]:
+    """在流失预测形状的数据上比较不同线程数的训练耗时"""
+    import pandas as pd
+    from sklearn.base import clone
+    from python_ml_service import ChurnPredictor, CustomerBehaviorPredictor
+    from ai_integration_test import AIIntegrationTester
+
+    data = AIIntegrationTester().generate_churn_data(n_rows)
+    churn_predictor = ChurnPredictor()
+    df = pd.DataFrame(data)
+    X = churn_predictor._prepare_churn_features(df)
+    y = df['is_churned'].values
+
+    estimators = {
+        'churn_random_forest': churn_predictor.model,
+        'behavior_xgboost_hist': CustomerBehaviorPredictor().model
+    }
+
+    rows = []
+    for name, estimator in estimators.items():
+        baseline = None
+        for n_threads in thread_counts:
+            model = clone(estimator).set_params(n_jobs=n_threads)
+            start = time.perf_counter()
+            model.fit(X, y)
+            duration = time.perf_counter() - start
+            baseline = baseline or duration
+            rows.append({
+                'model': name,
+                'threads': n_threads,
+                'fit_seconds': duration,
+                'speedup': baseline / duration
+            })
+    return rows
+
+# ================================================================================
+# 销售趋势预测延迟基准
+# ================================================================================
+
+def generate_sales_history(n_months: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """生成带季节性和增长趋势的月度销售数据"""
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2015-01-31', periods=n_months, freq=pd.offsets.MonthEnd())
+    months = np.arange(n_months)
+    amounts = (200000 * (1 + 0.2 * np.sin(2 * np.pi * months / 12)) * (1 + 0.05 * months / 12)
+               + rng.uniform(-20000, 20000, n_months))
+    order_counts = rng.integers(30, 80, n_months)
+    return [
+        {
+            'date': date.strftime('%Y-%m-%d'),
+            'order_count': int(orders),
+            'total_amount': float(amount),
+            'unique_customers': int(orders * 0.8),
+            'avg_order_value': float(amount / orders),
+            'marketing_spend': float(rng.uniform(5000, 15000))
+        }
+        for date, amount, orders in zip(dates, amounts, order_counts)
+    ]
+
+def benchmark_sales_forecast(month_counts: List[int], periods: List[int], repeat: int) -> List[Dict[str, Any]]:
+    """比较fast和full两种区间计算方式的单次预测延迟（含Random Forest融合，不经过结果缓存）"""
+    from python_ml_service import (
+        SalesTrendPredictor, SALES_FORECAST_MAX_HORIZON, SALES_PREDICT_LATENCY_BUDGET_MS
+    )
+
+    rows = []
+    for n_months in month_counts:
+        predictor = SalesTrendPredictor()
+        result = predictor.train(generate_sales_history(n_months))
+        if result['status'] != 'success':
+            logger.error(f"销售趋势模型训练失败: {result.get('message')}")
+            continue
+
+        for n_periods in periods:
+            for mode in ('fast', 'full'):
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    predictor.predict(n_periods, {'marketing_spend': 12000}, uncertainty=mode)
+                    timings.append(time.perf_counter() - start)
+                precomputed = mode == 'fast' and n_periods <= SALES_FORECAST_MAX_HORIZON
+                rows.append({
+                    'history_months': n_months,
+                    'periods': n_periods,
+                    'mode': mode,
+                    'path': 'precomputed' if precomputed else 'prophet',
+                    'p50_ms': float(np.percentile(timings, 50) * 1000),
+                    'p95_ms': float(np.percentile(timings, 95) * 1000),
+                    # 延迟预算只针对fast模式的预计算路径
+                    'within_budget': (bool(np.percentile(timings, 95) * 1000 <= SALES_PREDICT_LATENCY_BUDGET_MS)
+                                      if precomputed else '-')
+                })
+    return rows
+
+# ================================================================================
+# 多序列训练基准
+# ================================================================================
+
+def benchmark_sales_series(n_series: int, n_months: int, worker_counts: List[int]) -> List[Dict[str, Any]]:
+    """按销售人员分组生成n_series条月度序列，比较不同进程数的训练耗时"""
+    from python_ml_service import MultiSeriesSalesForecaster
+
+    orders = [
+        dict(row, assigned_user_id=user_id)
+        for user_id in range(n_series)
+        for row in generate_sales_history(n_months, seed=user_id)
+    ]
+
+    rows = []
+    baseline = None
+    for n_workers in worker_counts:
+        start = time.perf_counter()
+        result = MultiSeriesSalesForecaster().train(orders, dimensions=['assigned_user_id'], n_workers=n_workers)
+        duration = time.perf_counter() - start
+        if result['status'] != 'success':
+            logger.error(f"多序列训练失败: {result.get('message')}")
+            continue
+        baseline = baseline or duration
+        rows.append({
+            'workers': n_workers,
+            'series': result['model_metrics']['n_series'],
+            'failed': len(result['model_metrics']['failed_series']),
+            'wall_seconds': duration,
+            'speedup': baseline / duration
+        })
+    return rows
+
+# ================================================================================
+# 请求体格式基准
+# ================================================================================
+
+def benchmark_payload_format(n_rows: int, repeat: int) -> List[Dict[str, Any]]:
+    """比较JSON和列式请求体在批量流失预测接口上的解码耗时和端到端延迟"""
+    import json
+    import pandas as pd
+    from python_ml_service import app, model_registry, ChurnPredictor
+    from payload_formats import decode_frame, encode_frame, supported_content_types
+    from ai_integration_test import AIIntegrationTester
+
+    data = AIIntegrationTester().generate_churn_data(n_rows)
+    predictor = ChurnPredictor()
+    result = predictor.train(data[:min(n_rows, 5000)])
+    if result['status'] != 'success':
+        logger.error(f"流失模型训练失败: {result.get('message')}")
+        return []
+    model_registry.publish('churn', predictor)
+
+    customers = [{k: v for k, v in row.items() if k != 'is_churned'} for row in data]
+    frame = pd.DataFrame(customers)
+    bodies = {'application/json': json.dumps({'customers': customers}).encode()}
+    for content_type in supported_content_types():
+        bodies[content_type] = encode_frame(frame, content_type)
+
+    def decode(body: bytes, content_type: str) -> pd.DataFrame:
+        if content_type == 'application/json':
+            return pd.DataFrame(json.loads(body)['customers'])
+        return decode_frame(body, content_type)
+
+    client = app.test_client()
+    rows = []
+    for content_type, body in bodies.items():
+        decode_timings, request_timings = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            decode(body, content_type)
+            decode_timings.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            response = client.post('/models/churn/predict_batch', data=body, content_type=content_type)
+            request_timings.append(time.perf_counter() - start)
+            if response.get_json().get('total') != n_rows:
+                logger.error(f"批量预测失败 [{content_type}]: {response.get_json().get('message')}")
+        rows.append({
+            'format': content_type.split('/')[-1],
+            'body_mb': len(body) / 1024 / 1024,
+            'decode_ms': float(np.median(decode_timings) * 1000),
+            'request_ms': float(np.median(request_timings) * 1000)
+        })
+    return rows
+
+# ================================================================================
+# 单条预测微批处理基准
+# ================================================================================
+
+def benchmark_micro_batching(concurrency_levels: List[int], n_requests: int) -> List[Dict[str, Any]]:
+    """并发调用单条流失预测接口（/models/churn/predict），比较微批处理关闭和开启时的吞吐量"""
+    from concurrent.futures import ThreadPoolExecutor
+    from python_ml_service import app, model_registry, prediction_batchers, ChurnPredictor, MICRO_BATCH_MAX_SIZE
+    from micro_batching import MicroBatcher
+    from ai_integration_test import AIIntegrationTester
+
+    data = AIIntegrationTester().generate_churn_data(max(n_requests, 2000))
+    predictor = ChurnPredictor()
+    result = predictor.train(data[:2000])
+    if result['status'] != 'success':
+        logger.error(f"流失模型训练失败: {result.get('message')}")
+        return []
+    model_registry.publish('churn', predictor)
+
+    # 每个请求的客户不同，避免命中预测结果缓存
+    customers = [{k: v for k, v in row.items() if k != 'is_churned'} for row in data[:n_requests]]
+    client = app.test_client()
+    original = prediction_batchers['churn']
+
+    def call(customer: Dict[str, Any]) -> float:
+        start = time.perf_counter()
+        response = client.post('/models/churn/predict', json={'customer_data': customer})
+        if response.get_json().get('status') != 'success':
+            logger.error(f"预测失败: {response.get_json().get('message')}")
+        return time.perf_counter() - start
+
+    rows = []
+    try:
+        for concurrency in concurrency_levels:
+            for max_batch_size in (1, max(2, MICRO_BATCH_MAX_SIZE)):
+                batcher = MicroBatcher(
+                    original.process_batch, max_batch_size=max_batch_size,
+                    max_wait_ms=original.max_wait * 1000, max_concurrency=original.max_concurrency
+                )
+                prediction_batchers['churn'] = batcher
+                predictor.model_version = f"benchmark-{concurrency}-{max_batch_size}"
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    start = time.perf_counter()
+                    latencies = np.array(list(executor.map(call, customers)))
+                    duration = time.perf_counter() - start
+                rows.append({
+                    'concurrency': concurrency,
+                    'micro_batching': 'off' if max_batch_size <= 1 else 'on',
+                    'requests_per_second': n_requests / duration,
+                    'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                    'p99_ms': float(np.percentile(latencies, 99) * 1000),
+                    'avg_batch_size': batcher.status()['avg_batch_size'] if max_batch_size > 1 else 1.0
+                })
+    finally:
+        prediction_batchers['churn'] = original
+    return rows
+
+# ================================================================================
+# 随机森林推理基准
+# ================================================================================
+
+def benchmark_tree_inference(row_counts: List[int], repeat: int) -> List[Dict[str, Any]]:
+    """比较sklearn与CompiledForest在不同批量下的预测延迟，并校验结果逐位一致"""
+    import pandas as pd
+    from python_ml_service import ChurnPredictor, SalesTrendPredictor
+    from tree_inference import compile_forest
+    from ai_integration_test import AIIntegrationTester
+
+    data = AIIntegrationTester().generate_churn_data(max(row_counts + [5000]))
+    churn = ChurnPredictor()
+    if churn.train(data[:5000])['status'] != 'success':
+        logger.error("流失模型训练失败")
+        return []
+    churn_X = churn.scaler.transform(churn._prepare_churn_features(pd.DataFrame(data)))
+
+    sales = SalesTrendPredictor()
+    if sales.train(generate_sales_history(120))['status'] != 'success':
+        logger.error("销售趋势模型训练失败")
+        return []
+    sales_X = np.random.default_rng(0).normal(size=(max(row_counts), len(sales.feature_columns)))
+
+    forests = {
+        'churn_random_forest': (churn.model, churn_X, 'predict_proba'),
+        'sales_random_forest': (sales.rf_model, sales_X, 'predict'),
+    }
+
+    def median_ms(predict, X) -> float:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            predict(X)
+            timings.append(time.perf_counter() - start)
+        return float(np.median(timings) * 1000)
+
+    rows = []
+    for name, (forest, X_all, method) in forests.items():
+        start = time.perf_counter()
+        compiled = compile_forest(forest)
+        compile_ms = (time.perf_counter() - start) * 1000
+        for n_rows in row_counts:
+            X = X_all[:n_rows]
+            sklearn_predict, compiled_predict = getattr(forest, method), getattr(compiled, method)
+            sklearn_ms = median_ms(sklearn_predict, X)
+            compiled_ms = median_ms(compiled_predict, X)
+            rows.append({
+                'model': name,
+                'rows': n_rows,
+                'sklearn_ms': sklearn_ms,
+                'compiled_ms': compiled_ms,
+                'speedup': sklearn_ms / compiled_ms,
+                'identical': bool(np.array_equal(sklearn_predict(X), compiled_predict(X))),
+                'compile_ms': compile_ms
+            })
+    return rows
+
+# ================================================================================
+# 入口
+# ================================================================================
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='CRM ML服务性能基准测试')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    loading = subparsers.add_parser('model_loading', help='模型冷加载耗时和内存占用')
+    loading.add_argument('--workers', type=int, default=4, help='并发加载的工作进程数')
+    loading.add_argument('--models', nargs='*', default=MODEL_NAMES, help='要测试的模型名')
+    loading.add_argument('--prepare', type=int, default=0, help='先用N个模拟客户训练模型')
+
+    training = subparsers.add_parser('training', help='多核训练加速比')
+    training.add_argument('--rows', type=int, default=50000, help='训练样本数')
+    training.add_argument('--threads', type=int, nargs='*', default=[1, 2, 4, 8], help='测试的线程数')
+
+    forecast = subparsers.add_parser('sales_forecast', help='销售趋势预测fast/full模式延迟')
+    forecast.add_argument('--months', type=int, nargs='*', default=[24, 120], help='训练历史月数')
+    forecast.add_argument('--periods', type=int, nargs='*', default=[3, 12, 36], help='预测期数')
+    forecast.add_argument('--repeat', type=int, default=20, help='每种组合的重复次数')
+
+    series = subparsers.add_parser('sales_series', help='多序列销售预测并行训练加速比')
+    series.add_argument('--series', type=int, default=64, help='序列数')
+    series.add_argument('--months', type=int, default=36, help='每条序列的月数')
+    series.add_argument('--workers', type=int, nargs='*', default=[1, 2, 4, 8], help='测试的进程数')
+
+    payload = subparsers.add_parser('payload_format', help='批量预测请求体JSON vs Arrow/npz')
+    payload.add_argument('--rows', type=int, default=100000, help='每个请求的客户数')
+    payload.add_argument('--repeat', type=int, default=5, help='重复次数')
+
+    batching = subparsers.add_parser('micro_batching', help='并发单条预测的微批处理吞吐量')
+    batching.add_argument('--concurrency', type=int, nargs='*', default=[1, 8, 32], help='并发请求数')
+    batching.add_argument('--requests', type=int, default=2000, help='每种组合的请求总数')
+
+    trees = subparsers.add_parser('tree_inference', help='随机森林sklearn预测 vs NumPy节点数组遍历')
+    trees.add_argument('--rows', type=int, nargs='*', default=[1, 100, 10000], help='每次预测的行数')
+    trees.add_argument('--repeat', type=int, default=20, help='重复次数')
+
+    args = parser.parse_args()
+
+    # 基准用模拟数据训练并发布模型，MODEL_PATH指向临时目录，不影响正在服务的模型
+    # （版本监视线程会热切换current指针）；只读取现有模型的model_loading除外
+    scratch_dir = None
+    if args.benchmark != 'model_loading' or args.prepare:
+        scratch_dir = tempfile.mkdtemp(prefix='crm_ml_benchmark_')
+        os.environ['MODEL_PATH'] = scratch_dir
+
+    try:
+        if args.benchmark == 'model_loading':
+            if args.prepare:
+                prepare_models(args.prepare)
+            rows = benchmark_model_loading(args.workers, args.models)
+            print_table(f"模型加载基准 ({args.workers}个工作进程)", rows)
+        elif args.benchmark == 'training':
+            rows = benchmark_training(args.rows, args.threads)
+            print_table(f"多核训练基准 ({args.rows}条样本, CPU核心数: {os.cpu_count()})", rows)
+        elif args.benchmark == 'sales_forecast':
+            rows = benchmark_sales_forecast(args.months, args.periods, args.repeat)
+            print_table(f"销售趋势预测延迟基准 (每种组合{args.repeat}次)", rows)
+        elif args.benchmark == 'sales_series':
+            rows = benchmark_sales_series(args.series, args.months, args.workers)
+            print_table(f"多序列训练基准 ({args.series}条序列, CPU核心数: {os.cpu_count()})", rows)
+        elif args.benchmark == 'payload_format':
+            rows = benchmark_payload_format(args.rows, args.repeat)
+            print_table(f"批量流失预测请求体格式基准 ({args.rows}个客户)", rows)
+        elif args.benchmark == 'micro_batching':
+            rows = benchmark_micro_batching(args.concurrency, args.requests)
+            print_table(f"单条流失预测微批处理基准 (每种组合{args.requests}个请求)", rows)
+        elif args.benchmark == 'tree_inference':
+            rows = benchmark_tree_inference(args.rows, args.repeat)
+            print_table(f"随机森林推理基准 (每种批量{args.repeat}次)", rows)
+    finally:
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
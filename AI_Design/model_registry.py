@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - 模型注册中心
+
+服务启动时并行预加载所有模型，请求处理时只读取已发布的模型快照，
+训练完成后以原子替换的方式发布新模型（热切换），请求路径上不再发生反序列化。
+
+约定：
+- 已发布的模型实例不再被修改，训练总是在新实例上进行
+- 请求处理函数在开始时通过 get() 取一次快照，整个请求期间使用同一个实例
+- 预测器的 load(version) 加载指定版本，实例的 model_version 属性为已加载的版本号
+- 预测器自身不在请求路径上加载模型；启动时还没有模型、之后才发布的，由 get() 在
+  新实例上加锁加载后发布，请求线程不会同时修改同一个共享实例。加载不成功时记住结果，
+  之后的请求不再读取版本指针，新版本由后台监视线程发现并发布
+
+多工作进程部署时，每个进程通过 watch() 启动一个后台线程，定期读取模型的
+current版本指针，发现新版本后在后台加载并切换。每个进程同一时刻只加载一个模型，
+检查间隔带随机抖动，避免所有工作进程同时重新加载。
+"""
+
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """模型注册中心"""
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._snapshots: Dict[str, Any] = {}
+        self._published_at: Dict[str, Optional[str]] = {}
+        self._version_sources: Dict[str, Callable[[], Optional[str]]] = {}
+        self._failed_versions: Dict[str, str] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._unavailable: Set[str] = set()
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def register(self, name: str, factory: Callable[[], Any],
+                 version_source: Optional[Callable[[], Optional[str]]] = None) -> None:
+        """注册模型，factory返回一个未加载的预测器实例（需提供 load(version=None) -> bool）
+
+        version_source: 返回当前已发布版本号的函数，供 watch() 检查新版本
+        """
+        self._factories[name] = factory
+        self._snapshots[name] = factory()
+        self._published_at[name] = None
+        self._load_locks[name] = threading.Lock()
+        if version_source:
+            self._version_sources[name] = version_source
+
+    def preload(self) -> Dict[str, bool]:
+        """并行线程预加载所有已注册模型，返回各模型是否加载成功"""
+        def _load(name: str) -> bool:
+            instance = self._factories[name]()
+            try:
+                loaded = bool(instance.load())
+            except Exception as e:
+                logger.error(f"模型预加载失败 [{name}]: {e}")
+                return False
+            if loaded:
+                self.publish(name, instance)
+            return loaded
+
+        names = list(self._factories)
+        with ThreadPoolExecutor(max_workers=max(1, len(names))) as executor:
+            results = dict(zip(names, executor.map(_load, names)))
+
+        logger.info(f"模型预加载完成: {results}")
+        return results
+
+    def create(self, name: str) -> Any:
+        """创建一个新的空实例，用于训练"""
+        return self._factories[name]()
+
+    def get(self, name: str) -> Any:
+        """获取当前发布的模型快照；从未发布过时先尝试加载（见 ensure_loaded）"""
+        if self._published_at[name] is None and name not in self._unavailable:
+            return self.ensure_loaded(name)
+        return self._snapshots[name]
+
+    def ensure_loaded(self, name: str) -> Any:
+        """模型从未发布过时加载当前版本并发布，返回当前快照
+
+        加载在新实例上进行，同一模型同一时刻只有一个线程加载，其他线程等待后使用发布的快照。
+        只尝试一次：没有可用模型时记为不可用，get() 不再读取版本指针，直到后台监视线程
+        （refresh）或训练任务发布了模型。
+        """
+        with self._load_locks[name]:
+            if self._published_at[name] is not None or name in self._unavailable:
+                return self._snapshots[name]
+
+            version_source = self._version_sources.get(name)
+            version = None
+            instance = self._factories[name]()
+            try:
+                version = version_source() if version_source else None
+                loaded = bool(instance.load(version))
+            except Exception as e:
+                logger.error(f"模型加载失败 [{name}]: {e}")
+                loaded = False
+
+            if loaded:
+                self.publish(name, instance)
+            else:
+                if version:
+                    # 该版本不可用，refresh不再重复尝试，等待下一个版本发布
+                    self._failed_versions[name] = version
+                self._unavailable.add(name)
+        return self._snapshots[name]
+
+    def publish(self, name: str, instance: Any) -> Any:
+        """原子替换模型快照，返回被替换的旧实例"""
+        with self._lock:
+            previous = self._snapshots.get(name)
+            self._snapshots[name] = instance
+            self._published_at[name] = datetime.now().isoformat()
+            self._unavailable.discard(name)
+        logger.info(f"模型已发布: {name}")
+        return previous
+
+    def refresh(self) -> Dict[str, str]:
+        """检查各模型的已发布版本，加载并切换到新版本，返回本次切换的 {模型: 版本}"""
+        swapped = {}
+        for name, version_source in self._version_sources.items():
+            try:
+                version = version_source()
+            except Exception as e:
+                logger.error(f"模型版本检查失败 [{name}]: {e}")
+                continue
+            loaded_version = getattr(self._snapshots[name], 'model_version', None)
+            if not version or version == loaded_version or version == self._failed_versions.get(name):
+                continue
+
+            instance = self._factories[name]()
+            try:
+                loaded = bool(instance.load(version))
+            except Exception as e:
+                logger.error(f"模型新版本加载失败 [{name}@{version}]: {e}")
+                loaded = False
+            if loaded:
+                self.publish(name, instance)
+                swapped[name] = version
+            else:
+                # 同一版本不重复尝试，等待下一个版本发布
+                self._failed_versions[name] = version
+        return swapped
+
+    def watch(self, interval: float) -> None:
+        """启动后台线程定期检查新版本（每个进程调用一次，须在fork之后调用）"""
+        if interval <= 0 or (self._watcher and self._watcher.is_alive()):
+            return
+
+        def _loop():
+            while True:
+                time.sleep(interval * random.uniform(0.5, 1.5))
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"模型版本检查失败: {e}")
+
+        self._watcher = threading.Thread(target=_loop, name='model-watcher', daemon=True)
+        self._watcher.start()
+        logger.info(f"模型版本监视已启动，检查间隔: {interval}s")
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """各模型的发布状态和当前加载的版本"""
+        return {
+            name: {
+                'version': getattr(self._snapshots[name], 'model_version', None),
+                'published_at': published_at
+            }
+            for name, published_at in self._published_at.items()
+        }
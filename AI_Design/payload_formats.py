@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - 列式请求体
+
+训练和批量预测接口除JSON外，也接受按Content-Type区分的列式二进制请求体，
+直接解码为DataFrame，省去JSON解析和逐行字典转换：
+
+- application/vnd.apache.arrow.stream  Arrow IPC流格式
+- application/vnd.apache.arrow.file    Arrow IPC文件格式
+- application/x-npz                    numpy.savez保存的按列数组（每列一个数组）
+
+Arrow数值列（无空值时）和未压缩npz中的数值数组直接引用请求体内存，不做复制；
+字符串列需要转换为Python对象。Arrow依赖pyarrow（可选依赖），未安装时只支持npz。
+非JSON请求体时，其他请求参数（wait、target、chunk_size等）通过URL查询参数传递。
+"""
+
+import io
+import json
+import struct
+import zipfile
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except Exception:  # 未安装或与当前NumPy版本不兼容
+    pa = None
+
+ARROW_STREAM_TYPE = 'application/vnd.apache.arrow.stream'
+ARROW_FILE_TYPE = 'application/vnd.apache.arrow.file'
+NPZ_TYPE = 'application/x-npz'
+
+COLUMNAR_CONTENT_TYPES = (ARROW_STREAM_TYPE, ARROW_FILE_TYPE, NPZ_TYPE)
+
+# zip本地文件头: 固定30字节，文件名长度和扩展字段长度位于偏移26、28处
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+
+def supported_content_types() -> tuple:
+    """当前环境可解码的列式Content-Type"""
+    if pa is None:
+        return (NPZ_TYPE,)
+    return COLUMNAR_CONTENT_TYPES
+
+
+def encode_frame(df: pd.DataFrame, content_type: str) -> bytes:
+    """将DataFrame编码为列式请求体（供客户端、测试和基准使用）"""
+    sink = io.BytesIO()
+    if content_type in (ARROW_STREAM_TYPE, ARROW_FILE_TYPE):
+        if pa is None:
+            raise ValueError("未安装pyarrow，不支持Arrow请求体")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        new_writer = pa.ipc.new_stream if content_type == ARROW_STREAM_TYPE else pa.ipc.new_file
+        with new_writer(sink, table.schema) as writer:
+            writer.write_table(table)
+    elif content_type == NPZ_TYPE:
+        # 字符串列保存为定长Unicode数组（npz请求体不允许object数组）
+        np.savez(sink, **{
+            name: column.to_numpy().astype(str) if column.dtype.kind == 'O' else column.to_numpy()
+            for name, column in df.items()
+        })
+    else:
+        raise ValueError(f"不支持的请求体格式: {content_type}")
+    return sink.getvalue()
+
+
+def decode_frame(body: bytes, content_type: str) -> pd.DataFrame:
+    """将列式请求体解码为DataFrame"""
+    if content_type in (ARROW_STREAM_TYPE, ARROW_FILE_TYPE):
+        return decode_arrow(body, stream=content_type == ARROW_STREAM_TYPE)
+    if content_type == NPZ_TYPE:
+        return decode_npz(body)
+    raise ValueError(f"不支持的请求体格式: {content_type}")
+
+
+def decode_arrow(body: bytes, stream: bool = True) -> pd.DataFrame:
+    """解码Arrow IPC请求体，数值列零复制映射到请求体内存"""
+    if pa is None:
+        raise ValueError("服务未安装pyarrow，不支持Arrow请求体")
+    buffer = pa.py_buffer(body)
+    reader = pa.ipc.open_stream(buffer) if stream else pa.ipc.open_file(buffer)
+    table = reader.read_all()
+    # split_blocks避免把同类型的列合并成一个二维块（合并需要复制）
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def decode_npz(body: bytes) -> pd.DataFrame:
+    """解码npz请求体：未压缩的数值数组直接引用请求体内存，压缩的数组按普通方式读取"""
+    columns = {}
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type == zipfile.ZIP_STORED:
+                array = _stored_array(body, info)
+            else:
+                with archive.open(info) as member:
+                    array = np.lib.format.read_array(member, allow_pickle=False)
+            if array.ndim != 1:
+                raise ValueError(f"npz请求体的每个数组须为一维列: {name}")
+            columns[name] = pd.Series(array, copy=False)
+
+    lengths = {len(column) for column in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("npz请求体中各列长度不一致")
+    return pd.DataFrame(columns, copy=False)
+
+
+def _stored_array(body: bytes, info: zipfile.ZipInfo) -> np.ndarray:
+    """按zip本地文件头和.npy头定位未压缩数组的数据区，用frombuffer引用"""
+    name_length, extra_length = struct.unpack_from('<HH', body, info.header_offset + 26)
+    start = info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_length + extra_length
+
+    header = io.BytesIO(body[start:start + min(info.file_size, 65536)])
+    version = np.lib.format.read_magic(header)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+    if dtype.hasobject:
+        raise ValueError("npz请求体不支持object类型数组")
+
+    count = int(np.prod(shape))
+    array = np.frombuffer(body, dtype=dtype, count=count, offset=start + header.tell())
+    if not array.flags.aligned:
+        # 数据区未按元素大小对齐时复制一次，避免下游C扩展处理未对齐内存
+        array = array.copy()
+    return array.reshape(shape, order='F' if fortran_order else 'C')
+
+
+def parse_query_options(args: Dict[str, str]) -> Dict[str, Any]:
+    """解析URL查询参数：能按JSON解析的值（数字、布尔、列表）按JSON解析，否则保留字符串"""
+    options = {}
+    for key, value in args.items():
+        try:
+            options[key] = json.loads(value)
+        except ValueError:
+            options[key] = value
+    return options
@@ -15,9 +15,20 @@ CRM系统 - Python机器学习服务
 import os
 import sys
 import logging
+import time
+import hashlib
+import threading
 import traceback
+import shutil
+import copy
+import argparse
+import multiprocessing as mp
+from collections import OrderedDict
+from statistics import NormalDist
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Any, Union
 
 # 基础库
 import numpy as np
@@ -29,17 +40,30 @@ import joblib
 import json
 
 # 机器学习库
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler, LabelEncoder
+from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_absolute_error, accuracy_score, roc_auc_score
 import xgboost as xgb
 from prophet import Prophet
 
 # 推荐系统
+import scipy.sparse as sp
 from sklearn.decomposition import NMF
 from sklearn.metrics.pairwise import cosine_similarity
 
+# 模型注册中心与后台训练任务
+from model_registry import ModelRegistry
+from micro_batching import MicroBatcher
+from tree_inference import CompiledForest, compile_forest
+from feature_encoding import CategoricalVocabulary, FeaturePipeline
+from training_jobs import TrainingJobQueue
+from training_sources import get_connection, load_training_data
+from customer_features import load_customer_features, refresh_customer_features
+from serialization import SerializerJSONProvider, serializer
+from payload_formats import COLUMNAR_CONTENT_TYPES, decode_frame, parse_query_options, supported_content_types
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -53,6 +77,7 @@ logger = logging.getLogger(__name__)
 
 # Flask应用初始化
 app = Flask(__name__)
+app.json = SerializerJSONProvider(app)
 CORS(app)
 
 # Redis连接
@@ -73,6 +98,92 @@ except Exception as e:
 MODEL_PATH = os.getenv('MODEL_PATH', './models')
 os.makedirs(MODEL_PATH, exist_ok=True)
 
+# 模型加载的内存映射模式：模型文件不压缩保存，大数组以只读内存映射方式加载，
+# 多个工作进程通过操作系统页缓存共享同一份数据。设为空字符串则完整读入内存
+MODEL_MMAP_MODE = os.getenv('MODEL_MMAP_MODE', 'r') or None
+
+# 模型版本管理：每个模型保留的历史版本数，以及工作进程检查current版本指针的间隔（秒）
+MODEL_KEEP_VERSIONS = int(os.getenv('MODEL_KEEP_VERSIONS', 3))
+MODEL_WATCH_INTERVAL = float(os.getenv('MODEL_WATCH_INTERVAL', 5))
+
+# 销售趋势预测：训练时预计算的最长预测期（月），超出时实时调用Prophet
+SALES_FORECAST_MAX_HORIZON = int(os.getenv('SALES_FORECAST_MAX_HORIZON', 24))
+
+# 销售趋势预测区间的默认计算方式（可按请求指定）：
+# fast - 使用训练时保存的区间，超出预计算期数的日期按观测噪声和趋势外推解析计算，不做采样
+# full - 每次调用Prophet进行蒙特卡洛采样（uncertainty_samples次），包含趋势不确定性
+SALES_UNCERTAINTY_MODES = ('fast', 'full')
+SALES_UNCERTAINTY_MODE = os.getenv('SALES_UNCERTAINTY_MODE', 'fast')
+
+# 销售趋势集成模型：学习Prophet与Random Forest融合权重时留出的最近月数
+SALES_ENSEMBLE_HOLDOUT = int(os.getenv('SALES_ENSEMBLE_HOLDOUT', 6))
+
+# fast模式下销售趋势预测（含Random Forest融合，24个月预测期）的延迟预算（毫秒），超出时记录警告
+SALES_PREDICT_LATENCY_BUDGET_MS = float(os.getenv('SALES_PREDICT_LATENCY_BUDGET_MS', 20))
+
+# 多序列销售预测：分组维度、并行拟合的进程数、单个序列的拟合超时（秒）和最少月数
+SALES_SERIES_DIMENSIONS = ('department_id', 'assigned_user_id', 'source_channel')
+SALES_SERIES_WORKERS = int(os.getenv('SALES_SERIES_WORKERS', os.cpu_count() or 1))
+SALES_SERIES_FIT_TIMEOUT = int(os.getenv('SALES_SERIES_FIT_TIMEOUT', 60))
+SALES_SERIES_MIN_POINTS = int(os.getenv('SALES_SERIES_MIN_POINTS', 6))
+
+# 批量预测分块大小
+CHURN_BATCH_CHUNK_SIZE = int(os.getenv('CHURN_BATCH_CHUNK_SIZE', 10000))
+
+# 单条预测（churn、customer_behavior）的微批处理：每批最多条数（不大于1时不合并）、
+# 凑批最长等待时间（毫秒）、同时处理的批次数
+MICRO_BATCH_MAX_SIZE = int(os.getenv('MICRO_BATCH_MAX_SIZE', 64))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv('MICRO_BATCH_MAX_WAIT_MS', 5))
+MICRO_BATCH_CONCURRENCY = int(os.getenv('MICRO_BATCH_CONCURRENCY', 2))
+
+# 后台训练任务：同时训练的进程数和排队上限（每个工作进程各有一个队列，上限不是全局的）
+TRAINING_MAX_WORKERS = int(os.getenv('TRAINING_MAX_WORKERS', 1))
+TRAINING_MAX_PENDING = int(os.getenv('TRAINING_MAX_PENDING', 8))
+
+# 运行模式: dev（Flask开发服务器）或 production（预fork的Gunicorn，见serving.py），可用--mode覆盖
+ML_SERVE_MODE = os.getenv('ML_SERVE_MODE', 'dev')
+
+# 生产模式：工作进程数、每个工作进程的请求线程数、请求超时（秒），
+# 以及每个工作进程的推理进程数（未设置时按CPU核心数平均分配，0表示在请求线程中直接推理）
+ML_SERVE_WORKERS = int(os.getenv('ML_SERVE_WORKERS', 2))
+ML_SERVE_THREADS = int(os.getenv('ML_SERVE_THREADS', 16))
+ML_SERVE_TIMEOUT = int(os.getenv('ML_SERVE_TIMEOUT', 120))
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS')) if os.getenv('INFERENCE_WORKERS') else None
+
+# 训练资源配置：各模型训练线程数（-1表示使用全部核心）、推理线程数和XGBoost建树方法
+TRAINING_N_JOBS = {
+    'sales_trend': int(os.getenv('SALES_TREND_N_JOBS', -1)),
+    'customer_behavior': int(os.getenv('CUSTOMER_BEHAVIOR_N_JOBS', -1)),
+    'churn': int(os.getenv('CHURN_N_JOBS', -1)),
+}
+INFERENCE_N_JOBS = int(os.getenv('INFERENCE_N_JOBS', 1))
+XGB_TREE_METHOD = os.getenv('XGB_TREE_METHOD', 'hist')
+
+# 随机森林推理：不超过该行数的批次用训练后导出的节点数组做向量化遍历（见tree_inference.py，
+# 结果与sklearn一致），更大的批次仍用sklearn（大批量时逐棵树的C实现更快）；0表示始终使用sklearn
+COMPILED_FOREST_MAX_ROWS = int(os.getenv('COMPILED_FOREST_MAX_ROWS', 2048))
+
+# 进程内LRU缓存容量和最长保留时间（秒）
+LOCAL_CACHE_SIZE = int(os.getenv('LOCAL_CACHE_SIZE', 1024))
+LOCAL_CACHE_TTL = int(os.getenv('LOCAL_CACHE_TTL', 300))
+
+# 各模型预测结果的缓存时间（秒）
+PREDICTION_CACHE_TTL = {
+    'sales_trend': int(os.getenv('SALES_TREND_CACHE_TTL', 3600)),
+    'customer_behavior': int(os.getenv('CUSTOMER_BEHAVIOR_CACHE_TTL', 600)),
+    'churn': int(os.getenv('CHURN_CACHE_TTL', 600)),
+    'recommendation': int(os.getenv('RECOMMENDATION_CACHE_TTL', 1800)),
+    'sales_series': int(os.getenv('SALES_SERIES_CACHE_TTL', 3600)),
+}
+
+# 推荐索引检索的簇数 (召回率与延迟的权衡)，未设置时精确检索
+RECOMMENDATION_N_PROBE = int(os.getenv('RECOMMENDATION_N_PROBE')) if os.getenv('RECOMMENDATION_N_PROBE') else None
+
+# 预计算推荐表配置
+RECOMMENDATION_TOPN_SIZE = int(os.getenv('RECOMMENDATION_TOPN_SIZE', 50))
+RECOMMENDATION_TOPN_BLOCK_SIZE = int(os.getenv('RECOMMENDATION_TOPN_BLOCK_SIZE', 2048))
+RECOMMENDATION_TOPN_WORKERS = int(os.getenv('RECOMMENDATION_TOPN_WORKERS', min(4, os.cpu_count() or 1)))
+
 # ================================================================================
 # 工具函数
 # ================================================================================
@@ -84,45 +195,280 @@ def cache_key(prefix: str, **kwargs) -> str:
         key_parts.append(f"{k}:{v}")
     return ":".join(key_parts)
 
-def get_cached_result(key: str) -> Optional[Any]:
-    """从Redis获取缓存结果"""
+def content_cache_key(prefix: str, payload: Any, model_version: Optional[str]) -> Optional[str]:
+    """按请求内容和模型版本生成缓存键，模型重新训练后旧缓存自然失效
+    
+    模型版本未知（模型尚未加载）时返回None，表示不使用缓存。
+    """
+    if model_version is None:
+        return None
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    digest = hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+    return cache_key(prefix, version=model_version, hash=digest)
+
+# 进程内LRU缓存（Redis之前的第一级缓存）: key -> (过期时间, 结果)
+_local_cache: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+_local_cache_lock = threading.Lock()
+
+# 缓存命中统计（coalesced: 未命中后等待并发请求结果而无需重复计算的次数）
+cache_stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'coalesced': 0, 'sets': 0}
+
+def _count(stat: str, record_stats: bool = True) -> None:
+    if record_stats:
+        with _local_cache_lock:
+            cache_stats[stat] += 1
+
+def get_cached_result(key: str, record_stats: bool = True) -> Optional[Any]:
+    """获取缓存结果：先查进程内LRU，再查Redis"""
+    with _local_cache_lock:
+        entry = _local_cache.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                _local_cache.move_to_end(key)
+                if record_stats:
+                    cache_stats['local_hits'] += 1
+                return entry[1]
+            del _local_cache[key]
+    
     if not redis_client:
+        _count('misses', record_stats)
         return None
     try:
         cached = redis_client.get(key)
-        return json.loads(cached) if cached else None
+        if not cached:
+            _count('misses', record_stats)
+            return None
+        result = serializer.loads(cached)
+        ttl = redis_client.ttl(key)
+        _set_local(key, result, ttl if ttl and ttl > 0 else LOCAL_CACHE_TTL)
+        _count('redis_hits', record_stats)
+        return result
     except Exception as e:
         logger.warning(f"缓存读取失败: {e}")
+        _count('misses', record_stats)
         return None
 
+def _set_local(key: str, result: Any, ttl: int) -> None:
+    """写入进程内LRU，超出容量时淘汰最久未使用的条目"""
+    with _local_cache_lock:
+        _local_cache[key] = (time.monotonic() + min(ttl, LOCAL_CACHE_TTL), result)
+        _local_cache.move_to_end(key)
+        while len(_local_cache) > LOCAL_CACHE_SIZE:
+            _local_cache.popitem(last=False)
+
+# Redis写入线程：写缓存不阻塞请求（单线程保证同一键的写入顺序）
+_redis_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='redis-writer')
+
+def _write_redis(key: str, result: Any, ttl: int) -> None:
+    try:
+        redis_client.setex(key, ttl, serializer.dumps(result))
+    except Exception as e:
+        logger.warning(f"缓存设置失败: {e}")
+
 def set_cached_result(key: str, result: Any, ttl: int = 3600) -> None:
-    """设置Redis缓存"""
+    """设置缓存：进程内LRU立即写入，Redis在后台线程写入（结果写入缓存后不再修改）"""
+    _set_local(key, result, ttl)
+    _count('sets')
+    if redis_client:
+        _redis_writer.submit(_write_redis, key, result, ttl)
+
+def invalidate_cache(prefix: str) -> int:
+    """批量删除某一前缀（模型）下的全部缓存，返回删除的Redis键数量"""
+    with _local_cache_lock:
+        for key in [k for k in _local_cache if k.startswith(f"{prefix}:")]:
+            del _local_cache[key]
+    
     if not redis_client:
-        return
+        return 0
+    deleted = 0
     try:
-        redis_client.setex(key, ttl, json.dumps(result, default=str))
+        batch = []
+        for key in redis_client.scan_iter(match=f"{prefix}:*", count=1000):
+            batch.append(key)
+            if len(batch) >= 1000:
+                deleted += redis_client.delete(*batch)
+                batch = []
+        if batch:
+            deleted += redis_client.delete(*batch)
     except Exception as e:
-        logger.warning(f"缓存设置失败: {e}")
+        logger.warning(f"缓存清理失败: {e}")
+    logger.info(f"已清理缓存: {prefix} ({deleted}个键)")
+    return deleted
+
+# 单飞锁：同一缓存键并发未命中时只计算一次
+_inflight_locks: Dict[str, threading.Lock] = {}
+_inflight_guard = threading.Lock()
 
-def save_model(model: Any, model_name: str) -> str:
-    """保存模型到文件"""
-    model_file = os.path.join(MODEL_PATH, f"{model_name}.pkl")
-    joblib.dump(model, model_file)
+def get_or_compute(key: Optional[str], compute: Callable[[], Dict[str, Any]], ttl: int = 3600) -> Dict[str, Any]:
+    """读取缓存，未命中时计算并缓存成功的结果；并发的相同请求等待首个请求的结果"""
+    if key is None:
+        return compute()
+    
+    cached = get_cached_result(key)
+    if cached is not None:
+        return cached
+    
+    with _inflight_guard:
+        lock = _inflight_locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            # 等待期间其他请求可能已写入缓存（不重复计入统计）
+            cached = get_cached_result(key, record_stats=False)
+            if cached is not None:
+                _count('coalesced')
+                return cached
+            result = compute()
+            if result.get('status') == 'success':
+                set_cached_result(key, result, ttl)
+            return result
+    finally:
+        with _inflight_guard:
+            if _inflight_locks.get(key) is lock and not lock.locked():
+                del _inflight_locks[key]
+
+def load_feature_pipeline(saved_model: Dict[str, Any]) -> FeaturePipeline:
+    """读取模型保存的特征变换；旧版本模型（只保存了词表或LabelEncoder）由缩放器构造对应的变换"""
+    if 'feature_pipeline' in saved_model:
+        return saved_model['feature_pipeline']
+    vocabularies = saved_model.get('vocabularies') or {
+        column: CategoricalVocabulary.from_label_encoder(encoder)
+        for column, encoder in saved_model.get('label_encoders', {}).items()
+    }
+    scaler = saved_model['scaler']
+    pipeline = FeaturePipeline.from_legacy(scaler, vocabularies, saved_model.get('feature_columns'))
+    if hasattr(scaler, 'feature_names_in_'):
+        # 旧版本的缩放器以DataFrame拟合，特征变换输出的是NumPy矩阵（列顺序相同）
+        del scaler.feature_names_in_
+    return pipeline
+
+def forest_predict(model: Any, compiled: Optional[CompiledForest], X: np.ndarray,
+                   method: str = 'predict') -> np.ndarray:
+    """随机森林预测（predict / predict_proba）：小批量使用导出的节点数组，大批量或未导出时使用sklearn"""
+    if compiled is not None and len(X) <= COMPILED_FOREST_MAX_ROWS:
+        return getattr(compiled, method)(X)
+    return getattr(model, method)(X)
+
+def new_model_version() -> str:
+    """生成模型版本号（训练时间戳）"""
+    return datetime.now().strftime('%Y%m%d%H%M%S%f')
+
+def cached_predict(model_name: str, predictor: Any, payload: Any,
+                   compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """以请求内容和模型版本为键缓存预测结果，缓存时间按模型配置"""
+    key = content_cache_key(model_name, payload, predictor.model_version)
+    return get_or_compute(key, compute, ttl=PREDICTION_CACHE_TTL[model_name])
+
+# 模型按版本目录存放: MODEL_PATH/<模型名>/<版本号>/<产物>.pkl
+# 新版本先写入临时目录，写完后重命名为版本目录，再原子替换current指针文件，
+# 读取方总是先读指针再加载完整的版本目录，不会读到写了一半的文件
+MODEL_POINTER_FILE = 'current'
+
+def model_version_dir(model_name: str, version: str) -> str:
+    """模型版本目录"""
+    return os.path.join(MODEL_PATH, model_name, version)
+
+def current_model_version(model_name: str) -> Optional[str]:
+    """读取current指针指向的版本号，尚未发布过版本时返回None"""
+    try:
+        with open(os.path.join(MODEL_PATH, model_name, MODEL_POINTER_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def list_model_versions(model_name: str) -> List[str]:
+    """已发布的版本号列表（版本号为时间戳，按字典序即时间顺序）"""
+    model_dir = os.path.join(MODEL_PATH, model_name)
+    if not os.path.isdir(model_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(model_dir)
+        if not name.startswith('.') and os.path.isdir(os.path.join(model_dir, name))
+    )
+
+def stage_model_version(model_name: str) -> Tuple[str, str]:
+    """创建新版本的临时目录，返回 (版本号, 临时目录)"""
+    version = new_model_version()
+    staging_dir = os.path.join(MODEL_PATH, model_name, f".{version}.tmp")
+    os.makedirs(staging_dir)
+    return version, staging_dir
+
+@contextmanager
+def staged_model_version(model_name: str) -> Iterator[Tuple[str, str]]:
+    """创建新版本的临时目录，代码块中写入产物并发布；代码块失败时删除临时目录"""
+    version, staging_dir = stage_model_version(model_name)
+    try:
+        yield version, staging_dir
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+def fsync_path(path: str) -> None:
+    """把文件内容或目录项刷到磁盘"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def publish_model_version(model_name: str, version: str, staging_dir: str) -> str:
+    """发布新版本：产物刷盘后临时目录重命名为版本目录，再原子更新current指针
+    
+    每一步的目录项都刷到磁盘，崩溃后current指针不会指向不完整的版本。
+    """
+    for root, _, names in os.walk(staging_dir):
+        for name in names:
+            fsync_path(os.path.join(root, name))
+        fsync_path(root)
+    
+    model_dir = os.path.join(MODEL_PATH, model_name)
+    version_dir = model_version_dir(model_name, version)
+    os.rename(staging_dir, version_dir)
+    fsync_path(model_dir)
+    
+    pointer_file = os.path.join(model_dir, MODEL_POINTER_FILE)
+    pointer_tmp = f"{pointer_file}.{os.getpid()}.tmp"
+    with open(pointer_tmp, 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, pointer_file)
+    fsync_path(model_dir)
+    logger.info(f"模型版本已发布: {model_name} -> {version}")
+    
+    prune_model_versions(model_name)
+    return version_dir
+
+def prune_model_versions(model_name: str, keep: int = MODEL_KEEP_VERSIONS) -> None:
+    """删除较旧的版本目录，current指向的版本始终保留"""
+    current = current_model_version(model_name)
+    for version in list_model_versions(model_name)[:-keep]:
+        if version != current:
+            shutil.rmtree(model_version_dir(model_name, version), ignore_errors=True)
+
+def save_model(model: Any, model_name: str, directory: str) -> str:
+    """保存模型产物到版本目录（不压缩，NumPy数组按页对齐存放以支持内存映射）"""
+    model_file = os.path.join(directory, f"{model_name}.pkl")
+    joblib.dump(model, model_file, compress=0)
     logger.info(f"模型已保存: {model_file}")
     return model_file
 
-def load_model(model_name: str) -> Optional[Any]:
-    """从文件加载模型"""
-    model_file = os.path.join(MODEL_PATH, f"{model_name}.pkl")
+def load_model(model_name: str, directory: str, mmap_mode: Optional[str] = MODEL_MMAP_MODE) -> Optional[Any]:
+    """从版本目录加载模型产物"""
+    model_file = os.path.join(directory, f"{model_name}.pkl")
     if os.path.exists(model_file):
         try:
-            model = joblib.load(model_file)
+            model = joblib.load(model_file, mmap_mode=mmap_mode)
             logger.info(f"模型已加载: {model_file}")
             return model
         except Exception as e:
             logger.error(f"模型加载失败: {e}")
     return None
 
+def resolve_model_dir(model_name: str, version: Optional[str] = None) -> str:
+    """解析模型目录：默认使用current指针；从未发布过版本时兼容MODEL_PATH下的旧单文件模型"""
+    version = version or current_model_version(model_name)
+    return model_version_dir(model_name, version) if version else MODEL_PATH
+
 # ================================================================================
 # 销售趋势预测模型
 # ================================================================================
@@ -130,19 +476,40 @@ def load_model(model_name: str) -> Optional[Any]:
 class SalesTrendPredictor:
     """销售趋势预测器 - 结合Prophet和Random Forest"""
     
+    MODEL_NAME = 'sales_trend_model'
+    
+    # 预计算预测结果保存的列（additive_terms为Prophet各季节项之和）
+    FORECAST_COLUMNS = ('yhat', 'yhat_lower', 'yhat_upper', 'trend', 'additive_terms')
+    
     def __init__(self):
         self.prophet_model = None
+        self.forecast = None   # 预计算的预测结果（历史 + 未来max_horizon期），按列存放
         self.rf_model = RandomForestRegressor(
             n_estimators=100,
             max_depth=10,
-            random_state=42
+            random_state=42,
+            n_jobs=TRAINING_N_JOBS['sales_trend']
         )
+        self.compiled_rf = None    # rf_model导出的节点数组，用于小批量推理
         self.scaler = StandardScaler()
+        self.model_version = None
         self.feature_columns = [
             'order_count', 'unique_customers', 'avg_order_value', 
             'month', 'quarter', 'marketing_spend', 'seasonality'
         ]
+        self.feature_defaults = None    # 请求未提供的特征使用训练数据最近12个月的均值
+        self.ensemble_weights = None    # {'prophet': w, 'random_forest': 1 - w}，None表示只用Prophet
         
+    @staticmethod
+    def create_prophet_model() -> Prophet:
+        """创建月度销售序列使用的Prophet模型"""
+        return Prophet(
+            yearly_seasonality=True,
+            weekly_seasonality=False,
+            daily_seasonality=False,
+            changepoint_prior_scale=0.05
+        )
+    
     def prepare_data(self, data: List[Dict]) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """数据预处理"""
         df = pd.DataFrame(data)
@@ -173,12 +540,7 @@ class SalesTrendPredictor:
             prophet_df, rf_df = self.prepare_data(data)
             
             # 训练Prophet模型
-            self.prophet_model = Prophet(
-                yearly_seasonality=True,
-                weekly_seasonality=False,
-                daily_seasonality=False,
-                changepoint_prior_scale=0.05
-            )
+            self.prophet_model = self.create_prophet_model()
             self.prophet_model.fit(prophet_df)
             
             # 训练Random Forest模型
@@ -192,21 +554,42 @@ class SalesTrendPredictor:
             rf_pred = self.rf_model.predict(X_scaled)
             rf_mae = mean_absolute_error(y, rf_pred)
             
+            # 在留出的最近几个月上学习两个模型的融合权重
+            self.ensemble_weights, holdout_metrics = self._learn_ensemble_weights(prophet_df, X, y.values)
+            self.feature_defaults = X.tail(12).mean().to_dict()
+            
+            # 训练使用多线程，推理（多为小批量）使用单独的线程数
+            self.rf_model.set_params(n_jobs=INFERENCE_N_JOBS)
+            self.compiled_rf = compile_forest(self.rf_model)
+            
+            # Prophet预测对同一模型是确定的，训练时一次性计算所有预测期，预测时直接切片
+            self.forecast = self._run_forecast(SALES_FORECAST_MAX_HORIZON)
+            
             # 保存模型
-            model_data = {
-                'prophet_model': self.prophet_model,
-                'rf_model': self.rf_model,
-                'scaler': self.scaler,
-                'feature_columns': self.feature_columns
-            }
-            save_model(model_data, 'sales_trend_model')
+            with staged_model_version(self.MODEL_NAME) as (self.model_version, staging_dir):
+                model_data = {
+                    'prophet_model': self.prophet_model,
+                    'forecast': self.forecast,
+                    'rf_model': self.rf_model,
+                    'compiled_rf': self.compiled_rf,
+                    'scaler': self.scaler,
+                    'feature_columns': self.feature_columns,
+                    'feature_defaults': self.feature_defaults,
+                    'ensemble_weights': self.ensemble_weights,
+                    'model_version': self.model_version
+                }
+                save_model(model_data, self.MODEL_NAME, staging_dir)
+                publish_model_version(self.MODEL_NAME, self.model_version, staging_dir)
             
             return {
                 'status': 'success',
                 'model_metrics': {
                     'rf_mae': float(rf_mae),
+                    'ensemble_weights': self.ensemble_weights,
+                    **holdout_metrics,
                     'training_samples': len(data)
                 },
+                'model_version': self.model_version,
                 'trained_at': datetime.now().isoformat()
             }
             
@@ -214,53 +597,228 @@ class SalesTrendPredictor:
             logger.error(f"销售趋势模型训练失败: {e}")
             return {'status': 'error', 'message': str(e)}
     
-    def predict(self, future_periods: int = 3, features: Optional[Dict] = None) -> Dict[str, Any]:
-        """预测未来销售趋势"""
+    def load(self, version: Optional[str] = None) -> bool:
+        """加载指定版本的模型，默认加载current指针指向的版本"""
+        saved_model = load_model(self.MODEL_NAME, resolve_model_dir(self.MODEL_NAME, version))
+        if not saved_model:
+            return False
+        self.prophet_model = saved_model['prophet_model']
+        self.forecast = saved_model.get('forecast')
+        self.rf_model = saved_model['rf_model']
+        self.compiled_rf = saved_model.get('compiled_rf') or compile_forest(self.rf_model)
+        self.scaler = saved_model['scaler']
+        self.feature_columns = saved_model['feature_columns']
+        self.feature_defaults = saved_model.get('feature_defaults')
+        self.ensemble_weights = saved_model.get('ensemble_weights')
+        self.model_version = saved_model.get('model_version')
+        return True
+    
+    def _learn_ensemble_weights(self, prophet_df: pd.DataFrame, X: pd.DataFrame,
+                                y: np.ndarray) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """按时间留出最近SALES_ENSEMBLE_HOLDOUT个月，用其余数据分别拟合两个模型，
+        以留出期上的最小二乘求Prophet权重w（截断到[0, 1]），Random Forest权重为1 - w。
+        历史太短时使用等权重。
+        
+        留出期的Random Forest特征与预测时一样由build_future_features构建（请求不提供特征时
+        使用拟合部分最近12个月的均值），不使用留出期的真实订单数、客单价等，否则与总额
+        几乎线性相关的特征会让权重偏向Random Forest。
+        """
+        holdout = SALES_ENSEMBLE_HOLDOUT
+        n_train = len(y) - holdout
+        if holdout < 1 or n_train < holdout:
+            return {'prophet': 0.5, 'random_forest': 0.5}, {}
+        
+        prophet = self.create_prophet_model()
+        prophet.uncertainty_samples = 0
+        prophet.fit(prophet_df.iloc[:n_train])
+        prophet_pred = prophet.predict(prophet_df[['ds']].iloc[n_train:])['yhat'].values
+        X_train = X.iloc[:n_train]
+        scaler = clone(self.scaler).fit(X_train)
+        X_holdout = self.build_future_features(
+            prophet_df['ds'].values[n_train:], defaults=X_train.tail(12).mean().to_dict(), scaler=scaler
+        )
+        rf_pred = clone(self.rf_model).fit(scaler.transform(X_train), y[:n_train]).predict(X_holdout)
+        
+        actual = y[n_train:]
+        diff = prophet_pred - rf_pred
+        weight = float(np.clip(diff @ (actual - rf_pred) / (diff @ diff), 0.0, 1.0)) if diff @ diff > 0 else 0.5
+        blended = weight * prophet_pred + (1 - weight) * rf_pred
+        
+        return {'prophet': weight, 'random_forest': 1.0 - weight}, {
+            'holdout_months': holdout,
+            'holdout_prophet_mae': float(mean_absolute_error(actual, prophet_pred)),
+            'holdout_rf_mae': float(mean_absolute_error(actual, rf_pred)),
+            'holdout_ensemble_mae': float(mean_absolute_error(actual, blended))
+        }
+    
+    def build_future_features(self, dates: np.ndarray, features: Optional[Dict] = None,
+                              defaults: Optional[Dict[str, float]] = None,
+                              scaler: Optional[StandardScaler] = None) -> np.ndarray:
+        """构建预测期的Random Forest特征矩阵（已标准化）
+        
+        月份、季度、季节性由预测日期计算；其余特征取自features，可以是标量（所有预测期相同）
+        或长度等于预测期数的列表，未提供时使用defaults（默认为训练数据的近期均值）。
+        defaults和scaler默认使用训练好的模型的，学习融合权重时传入拟合部分的。
+        """
+        features = features or {}
+        defaults = defaults if defaults is not None else self.feature_defaults
+        scaler = scaler or self.scaler
+        months = pd.DatetimeIndex(dates).month.values
+        derived = {
+            'month': months,
+            'quarter': (months - 1) // 3 + 1,
+            'seasonality': np.sin(2 * np.pi * months / 12)
+        }
+        
+        X = np.empty((len(dates), len(self.feature_columns)), dtype=np.float64)
+        for j, column in enumerate(self.feature_columns):
+            if column in derived:
+                X[:, j] = derived[column]
+                continue
+            values = np.asarray(features.get(column, defaults[column]), dtype=np.float64)
+            if values.ndim > 0 and len(values) != len(dates):
+                raise ValueError(f"特征{column}的长度须为1或预测期数{len(dates)}")
+            X[:, j] = values
+        return (X - scaler.mean_) / scaler.scale_
+    
+    def _run_forecast(self, periods: int, uncertainty: str = 'full') -> Dict[str, Any]:
+        """运行Prophet预测（历史 + 未来periods期），结果按列转换为NumPy数组
+        
+        uncertainty为fast时跳过蒙特卡洛采样：训练时预计算覆盖的日期沿用预计算的区间，
+        之后的日期由_analytic_interval计算，同一日期的区间与请求的预测期数无关。
+        """
+        model = self.prophet_model
+        if uncertainty == 'fast':
+            # 在副本上关闭采样，不修改已发布的共享模型实例
+            model = copy.copy(model)
+            model.uncertainty_samples = 0
+        
+        future_dates = model.make_future_dataframe(periods=periods, freq='M')
+        forecast = model.predict(future_dates)
+        if uncertainty == 'fast':
+            n_history = len(future_dates) - periods
+            half_width = self._analytic_interval(n_history, periods)
+            forecast['yhat_lower'] = forecast['yhat'] - half_width
+            forecast['yhat_upper'] = forecast['yhat'] + half_width
+            if self.forecast is not None and self.forecast['n_history'] == n_history:
+                # yhat不依赖采样，预计算覆盖的行直接使用预计算的区间
+                stored = self.forecast['columns']
+                n_stored = min(len(stored['yhat']), len(forecast))
+                for column in ('yhat_lower', 'yhat_upper'):
+                    forecast.iloc[:n_stored, forecast.columns.get_loc(column)] = stored[column][:n_stored]
+        
+        columns = {'ds': forecast['ds'].dt.strftime('%Y-%m-%d').to_numpy().astype(str)}
+        columns.update({
+            column: forecast[column].to_numpy(dtype=np.float64) for column in self.FORECAST_COLUMNS
+        })
+        return {
+            'columns': columns,
+            'n_history': len(future_dates) - periods,
+            'horizon': periods
+        }
+    
+    def _analytic_interval(self, n_history: int, periods: int) -> np.ndarray:
+        """解析计算预测区间半宽（历史期 + 未来periods期）
+        
+        观测噪声部分由模型拟合的sigma_obs得到；趋势不确定性以训练时预计算的最后一期
+        区间为基准，按斜率随机游走的规律随每一期距历史末尾的期数的1.5次方外推，
+        只取决于该期本身，与请求的总期数无关。
+        """
+        model = self.prophet_model
+        z = NormalDist().inv_cdf(0.5 + model.interval_width / 2)
+        noise = z * float(np.mean(model.params['sigma_obs'])) * model.y_scale
+        
+        trend = np.zeros(n_history + periods)
+        if self.forecast is not None:
+            columns = self.forecast['columns']
+            stored = (columns['yhat_upper'][-1] - columns['yhat_lower'][-1]) / 2
+            trend_at_horizon = np.sqrt(max(0.0, stored ** 2 - noise ** 2))
+            trend[n_history:] = trend_at_horizon * (np.arange(1, periods + 1) / self.forecast['horizon']) ** 1.5
+        return np.sqrt(noise ** 2 + trend ** 2)
+    
+    def predict(self, future_periods: int = 3, features: Optional[Dict] = None,
+                uncertainty: str = SALES_UNCERTAINTY_MODE) -> Dict[str, Any]:
+        """预测未来销售趋势
+        
+        fast模式下预测期不超过训练时预计算的期数时直接切片预计算结果，否则实时调用
+        Prophet（不采样）；full模式每次实时调用Prophet并做蒙特卡洛采样。
+        """
         try:
+            started = time.perf_counter()
             if not self.prophet_model:
-                # 尝试加载已保存的模型
-                saved_model = load_model('sales_trend_model')
-                if saved_model:
-                    self.prophet_model = saved_model['prophet_model']
-                    self.rf_model = saved_model['rf_model']
-                    self.scaler = saved_model['scaler']
-                    self.feature_columns = saved_model['feature_columns']
-                else:
-                    return {'status': 'error', 'message': '模型未训练'}
-            
-            # Prophet预测
-            future_dates = self.prophet_model.make_future_dataframe(
-                periods=future_periods, 
-                freq='M'
-            )
-            prophet_forecast = self.prophet_model.predict(future_dates)
-            
-            # 提取预测结果
-            future_forecast = prophet_forecast.tail(future_periods)
-            
-            predictions = []
-            for _, row in future_forecast.iterrows():
-                pred = {
-                    'date': row['ds'].strftime('%Y-%m-%d'),
-                    'predicted_amount': float(row['yhat']),
-                    'lower_bound': float(row['yhat_lower']),
-                    'upper_bound': float(row['yhat_upper']),
+                return {'status': 'error', 'message': '模型未训练'}
+            
+            future_periods = int(future_periods)
+            if future_periods < 1:
+                return {'status': 'error', 'message': '预测期数必须为正整数'}
+            if uncertainty not in SALES_UNCERTAINTY_MODES:
+                return {'status': 'error', 'message': f"不支持的区间计算方式: {uncertainty}"}
+            
+            forecast = self.forecast
+            if uncertainty == 'full' or forecast is None or future_periods > forecast['horizon']:
+                forecast = self._run_forecast(future_periods, uncertainty)
+            
+            # 截取到第future_periods个预测期，与直接预测该期数的结果一致
+            start = forecast['n_history']
+            end = start + future_periods
+            columns = {name: values[:end] for name, values in forecast['columns'].items()}
+            prophet_yhat = columns['yhat'][start:]
+            
+            # Prophet与Random Forest按训练时学习的权重融合，预测区间随融合结果平移
+            if self.ensemble_weights is not None:
+                rf_yhat = forest_predict(
+                    self.rf_model, self.compiled_rf, self.build_future_features(columns['ds'][start:], features)
+                )
+                weight = self.ensemble_weights['prophet']
+                yhat = weight * prophet_yhat + (1 - weight) * rf_yhat
+                rf_amounts = rf_yhat.tolist()
+                algorithm = 'Prophet + Random Forest'
+            else:
+                yhat = prophet_yhat
+                rf_amounts = [None] * future_periods
+                algorithm = 'Prophet'
+            shift = yhat - prophet_yhat
+            
+            predictions = [
+                {
+                    'date': date,
+                    'predicted_amount': amount,
+                    'lower_bound': lower,
+                    'upper_bound': upper,
                     'confidence': 0.8,  # Prophet默认80%置信区间
-                    'trend': float(row.get('trend', 0)),
-                    'seasonal': float(row.get('seasonal', 0))
+                    'trend': trend,
+                    'seasonal': seasonal,
+                    'prophet_amount': prophet_amount,
+                    'rf_amount': rf_amount
                 }
-                predictions.append(pred)
+                for date, amount, lower, upper, trend, seasonal, prophet_amount, rf_amount in zip(
+                    columns['ds'][start:].tolist(),
+                    yhat.tolist(),
+                    (columns['yhat_lower'][start:] + shift).tolist(),
+                    (columns['yhat_upper'][start:] + shift).tolist(),
+                    columns['trend'][start:].tolist(),
+                    columns['additive_terms'][start:].tolist(),
+                    prophet_yhat.tolist(),
+                    rf_amounts
+                )
+            ]
             
             # 计算趋势分析
-            trend_analysis = self._analyze_trend(prophet_forecast)
+            trend_analysis = self._analyze_trend(columns)
+            
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if uncertainty == 'fast' and forecast is self.forecast and elapsed_ms > SALES_PREDICT_LATENCY_BUDGET_MS:
+                logger.warning(f"销售趋势预测耗时{elapsed_ms:.1f}ms，超出延迟预算{SALES_PREDICT_LATENCY_BUDGET_MS}ms")
             
             return {
                 'status': 'success',
                 'predictions': predictions,
                 'trend_analysis': trend_analysis,
                 'model_info': {
-                    'algorithm': 'Prophet + Random Forest',
+                    'algorithm': algorithm,
+                    'ensemble_weights': self.ensemble_weights,
                     'prediction_horizon': future_periods,
+                    'uncertainty_mode': uncertainty,
                     'predicted_at': datetime.now().isoformat()
                 }
             }
@@ -269,9 +827,10 @@ class SalesTrendPredictor:
             logger.error(f"销售趋势预测失败: {e}")
             return {'status': 'error', 'message': str(e)}
     
-    def _analyze_trend(self, forecast: pd.DataFrame) -> Dict[str, Any]:
-        """分析趋势"""
-        recent_trend = forecast['trend'].tail(6).pct_change().mean()
+    def _analyze_trend(self, columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+        """分析趋势（历史 + 预测期的各列数组）"""
+        recent = columns['trend'][-6:]
+        recent_trend = np.mean(np.diff(recent) / recent[:-1]) if len(recent) > 1 else 0.0
         
         trend_direction = 'stable'
         if recent_trend > 0.05:
@@ -282,10 +841,207 @@ class SalesTrendPredictor:
         return {
             'direction': trend_direction,
             'trend_rate': float(recent_trend),
-            'seasonality_strength': float(forecast['seasonal'].std()),
-            'volatility': float(forecast['yhat'].std())
+            'seasonality_strength': float(np.std(columns['additive_terms'], ddof=1)),
+            'volatility': float(np.std(columns['yhat'], ddof=1))
         }
 
+# ================================================================================
+# 多序列销售预测（按部门、销售人员、来源渠道）
+# ================================================================================
+
+def _fit_sales_series(key: str, ds: np.ndarray, y: np.ndarray, horizon: int, timeout: int) -> Dict[str, Any]:
+    """在进程池中拟合单个序列并预计算预测结果
+    
+    超时由cmdstanpy控制：CmdStan优化进程运行超过timeout秒时被终止并抛出TimeoutError。
+    Prophet在LBFGS异常退出时会改用Newton重试，重试同样受timeout限制。
+    """
+    start = time.perf_counter()
+    predictor = SalesTrendPredictor()
+    try:
+        predictor.prophet_model = predictor.create_prophet_model()
+        predictor.prophet_model.fit(pd.DataFrame({'ds': ds, 'y': y}), **({'timeout': timeout} if timeout > 0 else {}))
+        forecast = predictor._run_forecast(horizon)
+    except TimeoutError:
+        return {'key': key, 'status': 'timeout', 'message': f"拟合超过{timeout}秒"}
+    except Exception as e:
+        return {'key': key, 'status': 'error', 'message': str(e)}
+    
+    return {
+        'key': key,
+        'status': 'success',
+        'prophet_model': predictor.prophet_model,
+        'forecast': forecast,
+        'fit_seconds': time.perf_counter() - start
+    }
+
+class MultiSeriesSalesForecaster:
+    """多序列销售预测器 - 每个分组（部门/销售人员/来源渠道）一个Prophet模型
+    
+    训练时订单按分组和月份汇总，各序列在进程池中并行拟合并预计算预测结果；
+    预测时对每个序列复用SalesTrendPredictor的切片预测逻辑，一次返回所有分组。
+    """
+    
+    MODEL_NAME = 'sales_series_model'
+    
+    def __init__(self):
+        self.series: Dict[str, Dict[str, Any]] = {}   # 序列键 "维度=分组值" -> 序列信息
+        self.predictors: Dict[str, SalesTrendPredictor] = {}
+        self.model_version = None
+    
+    @staticmethod
+    def build_series(data: Union[List[Dict], pd.DataFrame],
+                     dimensions: Tuple[str, ...] = SALES_SERIES_DIMENSIONS) -> Dict[str, Dict[str, Any]]:
+        """将订单记录按维度和月份汇总为月度销售额序列
+        
+        日期取order_date（兼容date字段），统一到月末；分组在首末月份之间没有订单的月份记为0。
+        """
+        df = pd.DataFrame(data)
+        date_column = 'order_date' if 'order_date' in df.columns else 'date'
+        df['ds'] = pd.to_datetime(df[date_column]).dt.normalize() + pd.offsets.MonthEnd(0)
+        df['total_amount'] = pd.to_numeric(df['total_amount'], errors='coerce').fillna(0)
+        
+        series = {}
+        for dimension in dimensions:
+            if dimension not in df.columns:
+                continue
+            monthly = df.dropna(subset=[dimension]).groupby([dimension, 'ds'])['total_amount'].sum()
+            for group, values in monthly.groupby(level=0):
+                values = values.droplevel(0).asfreq(pd.offsets.MonthEnd(), fill_value=0)
+                series[f"{dimension}={group}"] = {
+                    'dimension': dimension,
+                    'group': group.item() if isinstance(group, np.generic) else group,
+                    'ds': values.index.values,
+                    'y': values.values.astype(np.float64)
+                }
+        return series
+    
+    def train(self, data: List[Dict], dimensions: Optional[List[str]] = None,
+              n_workers: int = SALES_SERIES_WORKERS, timeout: int = SALES_SERIES_FIT_TIMEOUT,
+              min_points: int = SALES_SERIES_MIN_POINTS) -> Dict[str, Any]:
+        """并行训练所有分组序列"""
+        try:
+            start = time.perf_counter()
+            all_series = self.build_series(data, tuple(dimensions or SALES_SERIES_DIMENSIONS))
+            skipped = [key for key, item in all_series.items() if len(item['y']) < min_points]
+            to_fit = {key: item for key, item in all_series.items() if len(item['y']) >= min_points}
+            if not to_fit:
+                return {'status': 'error', 'message': f"没有月数不少于{min_points}的序列"}
+            
+            # 每个序列一个任务，进程池按核心数并行；超时的序列单独记录，不影响其他序列
+            args = [(key, item['ds'], item['y'], SALES_FORECAST_MAX_HORIZON, timeout) for key, item in to_fit.items()]
+            if n_workers > 1 and len(args) > 1:
+                with ProcessPoolExecutor(max_workers=min(n_workers, len(args))) as executor:
+                    results = list(executor.map(_fit_sales_series, *zip(*args)))
+            else:
+                results = [_fit_sales_series(*arg) for arg in args]
+            
+            self.series = {}
+            failed = {}
+            for result in results:
+                key = result['key']
+                if result['status'] != 'success':
+                    failed[key] = result['message']
+                    continue
+                self.series[key] = {
+                    'dimension': to_fit[key]['dimension'],
+                    'group': to_fit[key]['group'],
+                    'n_points': len(to_fit[key]['y']),
+                    'prophet_model': result['prophet_model'],
+                    'forecast': result['forecast']
+                }
+            if not self.series:
+                return {'status': 'error', 'message': '所有序列拟合失败', 'failed': failed}
+            self._build_predictors()
+            
+            # 保存模型
+            with staged_model_version(self.MODEL_NAME) as (self.model_version, staging_dir):
+                save_model({'series': self.series, 'model_version': self.model_version}, self.MODEL_NAME, staging_dir)
+                publish_model_version(self.MODEL_NAME, self.model_version, staging_dir)
+            
+            return {
+                'status': 'success',
+                'model_metrics': {
+                    'n_series': len(self.series),
+                    'skipped_series': skipped,
+                    'failed_series': failed,
+                    'fit_seconds': float(sum(r.get('fit_seconds', 0.0) for r in results)),
+                    'wall_seconds': float(time.perf_counter() - start),
+                    'workers': n_workers,
+                    'training_samples': len(data)
+                },
+                'model_version': self.model_version,
+                'trained_at': datetime.now().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"多序列销售预测模型训练失败: {e}")
+            return {'status': 'error', 'message': str(e)}
+    
+    def _build_predictors(self) -> None:
+        """为每个序列创建只包含Prophet模型和预计算结果的SalesTrendPredictor"""
+        self.predictors = {}
+        for key, item in self.series.items():
+            predictor = SalesTrendPredictor()
+            predictor.prophet_model = item['prophet_model']
+            predictor.forecast = item['forecast']
+            predictor.model_version = self.model_version
+            self.predictors[key] = predictor
+    
+    def load(self, version: Optional[str] = None) -> bool:
+        """加载指定版本的模型，默认加载current指针指向的版本"""
+        saved_model = load_model(self.MODEL_NAME, resolve_model_dir(self.MODEL_NAME, version))
+        if not saved_model:
+            return False
+        self.series = saved_model['series']
+        self.model_version = saved_model.get('model_version')
+        self._build_predictors()
+        return True
+    
+    def predict_batch(self, future_periods: int = 3, uncertainty: str = SALES_UNCERTAINTY_MODE,
+                      dimension: Optional[str] = None, groups: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """一次返回所有（或按维度、分组值筛选的）序列的预测结果"""
+        try:
+            if not self.series:
+                return {'status': 'error', 'message': '多序列销售预测模型未训练'}
+            
+            wanted_groups = {str(group) for group in groups} if groups else None
+            forecasts = []
+            failed = {}
+            for key, item in self.series.items():
+                if dimension and item['dimension'] != dimension:
+                    continue
+                if wanted_groups is not None and str(item['group']) not in wanted_groups:
+                    continue
+                
+                result = self.predictors[key].predict(future_periods, uncertainty=uncertainty)
+                if result['status'] != 'success':
+                    failed[key] = result['message']
+                    continue
+                forecasts.append({
+                    'series': key,
+                    'dimension': item['dimension'],
+                    'group': item['group'],
+                    'predictions': result['predictions'],
+                    'trend_analysis': result['trend_analysis']
+                })
+            
+            return {
+                'status': 'success',
+                'forecasts': forecasts,
+                'total': len(forecasts),
+                'failed': failed,
+                'model_info': {
+                    'algorithm': 'Prophet (per series)',
+                    'prediction_horizon': future_periods,
+                    'uncertainty_mode': uncertainty,
+                    'predicted_at': datetime.now().isoformat()
+                }
+            }
+            
+        except Exception as e:
+            logger.error(f"多序列销售预测失败: {e}")
+            return {'status': 'error', 'message': str(e)}
+
 # ================================================================================
 # 客户行为预测模型
 # ================================================================================
@@ -293,52 +1049,42 @@ class SalesTrendPredictor:
 class CustomerBehaviorPredictor:
     """客户行为预测器 - 使用XGBoost"""
     
+    MODEL_NAME = 'customer_behavior_model'
+    
+    # 特征：数值列（缺失值按训练时的中位数填充）和分类列（按训练时的词表编码）
+    NUMERIC_FEATURES = ['days_since_last_order', 'order_frequency', 'avg_order_value',
+                        'total_spent', 'interaction_frequency', 'days_since_last_contact',
+                        'support_ticket_count', 'payment_delay', 'customer_age_days']
+    CATEGORICAL_FEATURES = ['business_type', 'source_channel']
+    
     def __init__(self):
         self.model = xgb.XGBRegressor(
             n_estimators=100,
             max_depth=6,
             learning_rate=0.1,
-            random_state=42
+            random_state=42,
+            tree_method=XGB_TREE_METHOD,
+            n_jobs=TRAINING_N_JOBS['customer_behavior']
         )
         self.scaler = StandardScaler()
-        self.label_encoders = {}
-        self.feature_columns = [
-            'days_since_last_order', 'order_frequency', 'avg_order_value',
-            'total_spent', 'interaction_frequency', 'days_since_last_contact',
-            'support_ticket_count', 'payment_delay', 'customer_age_days',
-            'business_type_encoded', 'source_channel_encoded'
-        ]
+        self.features: Optional[FeaturePipeline] = None    # 训练时拟合的特征变换（缺失值填充、分类编码）
+        self.model_version = None
+        self.feature_columns = self.NUMERIC_FEATURES + [f'{col}_encoded' for col in self.CATEGORICAL_FEATURES]
     
-    def prepare_features(self, data: List[Dict]) -> pd.DataFrame:
-        """特征预处理"""
-        df = pd.DataFrame(data)
-        
-        # 编码分类变量
-        categorical_columns = ['business_type', 'source_channel']
-        for col in categorical_columns:
-            if col in df.columns:
-                if col not in self.label_encoders:
-                    self.label_encoders[col] = LabelEncoder()
-                    df[f'{col}_encoded'] = self.label_encoders[col].fit_transform(df[col].astype(str))
-                else:
-                    df[f'{col}_encoded'] = self.label_encoders[col].transform(df[col].astype(str))
-        
-        # 填充缺失值
-        numeric_columns = ['days_since_last_order', 'order_frequency', 'avg_order_value',
-                          'total_spent', 'interaction_frequency', 'days_since_last_contact',
-                          'support_ticket_count', 'payment_delay', 'customer_age_days']
-        
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = df[col].fillna(df[col].median())
-        
-        return df[self.feature_columns]
+    def prepare_features(self, data: Union[List[Dict], pd.DataFrame]) -> np.ndarray:
+        """特征预处理：按训练时的中位数填充缺失值、按词表编码分类变量（未训练的实例按输入数据拟合）"""
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        if self.features is None:
+            self.features = FeaturePipeline.fit(df, self.NUMERIC_FEATURES, self.CATEGORICAL_FEATURES)
+            self.feature_columns = self.features.feature_columns
+        return self.features.transform(df)
     
     def train(self, data: List[Dict], target_column: str = 'customer_value') -> Dict[str, Any]:
         """训练客户行为预测模型"""
         try:
             df = pd.DataFrame(data)
-            X = self.prepare_features(data)
+            self.features = None
+            X = self.prepare_features(df)
             y = df[target_column]
             
             # 数据划分
@@ -366,14 +1112,20 @@ class CustomerBehaviorPredictor:
                 self.model.feature_importances_
             ))
             
+            # 训练使用多线程，推理（多为小批量）使用单独的线程数
+            self.model.set_params(n_jobs=INFERENCE_N_JOBS)
+            
             # 保存模型
-            model_data = {
-                'model': self.model,
-                'scaler': self.scaler,
-                'label_encoders': self.label_encoders,
-                'feature_columns': self.feature_columns
-            }
-            save_model(model_data, 'customer_behavior_model')
+            with staged_model_version(self.MODEL_NAME) as (self.model_version, staging_dir):
+                model_data = {
+                    'model': self.model,
+                    'scaler': self.scaler,
+                    'feature_pipeline': self.features,
+                    'feature_columns': self.feature_columns,
+                    'model_version': self.model_version
+                }
+                save_model(model_data, self.MODEL_NAME, staging_dir)
+                publish_model_version(self.MODEL_NAME, self.model_version, staging_dir)
             
             return {
                 'status': 'success',
@@ -383,6 +1135,7 @@ class CustomerBehaviorPredictor:
                     'feature_importance': {k: float(v) for k, v in feature_importance.items()}
                 },
                 'training_samples': len(data),
+                'model_version': self.model_version,
                 'trained_at': datetime.now().isoformat()
             }
             
@@ -390,40 +1143,89 @@ class CustomerBehaviorPredictor:
             logger.error(f"客户行为模型训练失败: {e}")
             return {'status': 'error', 'message': str(e)}
     
+    def is_loaded(self) -> bool:
+        """模型是否已训练或加载（预测时不从文件恢复，未发布的模型由模型注册中心加载）"""
+        return hasattr(self.model, 'feature_importances_')
+    
+    def load(self, version: Optional[str] = None) -> bool:
+        """加载指定版本的模型，默认加载current指针指向的版本"""
+        saved_model = load_model(self.MODEL_NAME, resolve_model_dir(self.MODEL_NAME, version))
+        if not saved_model:
+            return False
+        self.model = saved_model['model']
+        self.scaler = saved_model['scaler']
+        self.features = load_feature_pipeline(saved_model)
+        self.feature_columns = saved_model['feature_columns']
+        self.model_version = saved_model.get('model_version')
+        return True
+    
     def predict(self, customer_data: Dict) -> Dict[str, Any]:
         """预测客户行为"""
+        return self.predict_each([customer_data])[0]
+    
+    def predict_each(self, customers: List[Dict]) -> List[Dict[str, Any]]:
+        """逐条预测的结果格式、批量的计算：多个独立的单客户请求合并为一次特征预处理和一次model.predict
+        
+        特征变换只使用训练时的统计量，每个客户的结果与单独预测时相同。
+        """
         try:
-            # 加载模型
-            if not hasattr(self.model, 'feature_importances_'):
-                saved_model = load_model('customer_behavior_model')
-                if saved_model:
-                    self.model = saved_model['model']
-                    self.scaler = saved_model['scaler']
-                    self.label_encoders = saved_model['label_encoders']
-                    self.feature_columns = saved_model['feature_columns']
-                else:
-                    return {'status': 'error', 'message': '模型未训练'}
+            # 模型未发布时返回错误
+            if not self.is_loaded():
+                return [{'status': 'error', 'message': '模型未训练'} for _ in customers]
             
             # 特征准备
-            X = self.prepare_features([customer_data])
+            X = self.prepare_features(customers)
             X_scaled = self.scaler.transform(X)
             
             # 预测
-            prediction = self.model.predict(X_scaled)[0]
+            predictions = self.model.predict(X_scaled).astype(float).tolist()
+            
+            # 置信度基于单个请求特征的标准差：每个请求只有一行，样本标准差无定义（NaN），取下限0.5
+            confidence = 0.5
+            prediction_date = datetime.now().isoformat()
+            
+            return [
+                {
+                    'status': 'success',
+                    'customer_id': customer_data.get('customer_id'),
+                    'predicted_value': prediction,
+                    'confidence': confidence,
+                    'prediction_date': prediction_date
+                }
+                for customer_data, prediction in zip(customers, predictions)
+            ]
             
-            # 计算置信度 (基于特征的标准差)
-            confidence = min(0.95, max(0.5, 1.0 - (X.std().mean() / 10)))
+        except Exception as e:
+            logger.error(f"客户行为预测失败: {e}")
+            return [{'status': 'error', 'message': str(e)} for _ in customers]
+    
+    def predict_many(self, customers: Union[List[Dict], Dict[str, List]]) -> Dict[str, Any]:
+        """批量预测客户价值
+        
+        整批数据只做一次特征预处理和一次model.predict，结果保持输入顺序。
+        """
+        try:
+            if not self.is_loaded():
+                return {'status': 'error', 'message': '模型未训练'}
+            
+            df = pd.DataFrame(customers)
+            X_scaled = self.scaler.transform(self.prepare_features(df))
+            predictions = self.model.predict(X_scaled)
+            
+            customer_ids = df['customer_id'].tolist() if 'customer_id' in df.columns else [None] * len(df)
             
             return {
                 'status': 'success',
-                'customer_id': customer_data.get('customer_id'),
-                'predicted_value': float(prediction),
-                'confidence': float(confidence),
+                'predictions': [
+                    {'customer_id': customer_id, 'predicted_value': value}
+                    for customer_id, value in zip(customer_ids, predictions.astype(float).tolist())
+                ],
+                'total': len(df),
                 'prediction_date': datetime.now().isoformat()
             }
             
         except Exception as e:
-            logger.error(f"客户行为预测失败: {e}")
+            logger.error(f"批量客户行为预测失败: {e}")
             return {'status': 'error', 'message': str(e)}
 
 # ================================================================================
@@ -433,22 +1235,34 @@ class CustomerBehaviorPredictor:
 class ChurnPredictor:
     """客户流失预测器"""
     
+    MODEL_NAME = 'churn_prediction_model'
+    
+    # 特征：数值列（缺失值按训练时的中位数填充）和分类列（按训练时的词表编码）
+    NUMERIC_FEATURES = ['days_since_last_order', 'order_frequency', 'avg_order_value',
+                        'total_spent', 'days_since_last_contact', 'support_ticket_count',
+                        'payment_delay_avg', 'customer_age_days']
+    CATEGORICAL_FEATURES = ['business_type', 'source_channel', 'customer_level']
+    
     def __init__(self):
         self.model = RandomForestClassifier(
             n_estimators=100,
             max_depth=10,
             random_state=42,
-            class_weight='balanced'
+            class_weight='balanced',
+            n_jobs=TRAINING_N_JOBS['churn']
         )
+        self.compiled_model = None    # 导出的节点数组，用于小批量推理
         self.scaler = StandardScaler()
-        self.label_encoders = {}
+        self.features: Optional[FeaturePipeline] = None    # 训练时拟合的特征变换（缺失值填充、分类编码）
+        self.model_version = None
     
     def train(self, data: List[Dict]) -> Dict[str, Any]:
         """训练流失预测模型"""
         try:
             df = pd.DataFrame(data)
             
-            # 特征工程
+            # 特征工程（按训练数据拟合特征变换）
+            self.features = None
             X = self._prepare_churn_features(df)
             y = df['is_churned']  # 0: 未流失, 1: 已流失
             
@@ -473,13 +1287,21 @@ class ChurnPredictor:
             test_acc = accuracy_score(y_test, test_pred)
             auc_score = roc_auc_score(y_test, test_proba)
             
+            # 训练使用多线程，推理（多为小批量）使用单独的线程数
+            self.model.set_params(n_jobs=INFERENCE_N_JOBS)
+            self.compiled_model = compile_forest(self.model)
+            
             # 保存模型
-            model_data = {
-                'model': self.model,
-                'scaler': self.scaler,
-                'label_encoders': self.label_encoders
-            }
-            save_model(model_data, 'churn_prediction_model')
+            with staged_model_version(self.MODEL_NAME) as (self.model_version, staging_dir):
+                model_data = {
+                    'model': self.model,
+                    'compiled_model': self.compiled_model,
+                    'scaler': self.scaler,
+                    'feature_pipeline': self.features,
+                    'model_version': self.model_version
+                }
+                save_model(model_data, self.MODEL_NAME, staging_dir)
+                publish_model_version(self.MODEL_NAME, self.model_version, staging_dir)
             
             return {
                 'status': 'success',
@@ -489,6 +1311,7 @@ class ChurnPredictor:
                     'auc_score': float(auc_score)
                 },
                 'training_samples': len(data),
+                'model_version': self.model_version,
                 'trained_at': datetime.now().isoformat()
             }
             
@@ -496,130 +1319,360 @@ class ChurnPredictor:
             logger.error(f"流失预测模型训练失败: {e}")
             return {'status': 'error', 'message': str(e)}
     
+    def is_loaded(self) -> bool:
+        """模型是否已训练或加载（预测时不从文件恢复，未发布的模型由模型注册中心加载）"""
+        return hasattr(self.model, 'feature_importances_')
+    
+    def load(self, version: Optional[str] = None) -> bool:
+        """加载指定版本的模型，默认加载current指针指向的版本"""
+        saved_model = load_model(self.MODEL_NAME, resolve_model_dir(self.MODEL_NAME, version))
+        if not saved_model:
+            return False
+        self.model = saved_model['model']
+        self.compiled_model = saved_model.get('compiled_model') or compile_forest(self.model)
+        self.scaler = saved_model['scaler']
+        self.features = load_feature_pipeline(saved_model)
+        self.model_version = saved_model.get('model_version')
+        return True
+    
     def predict_churn_probability(self, customer_data: Dict) -> Dict[str, Any]:
         """预测客户流失概率"""
+        return self.predict_churn_each([customer_data])[0]
+    
+    def predict_churn_each(self, customers: List[Dict]) -> List[Dict[str, Any]]:
+        """逐条预测的结果格式、批量的计算：多个独立的单客户请求合并为一次特征预处理和一次predict_proba
+        
+        特征变换只使用训练时的统计量，每个客户的结果与单独预测时相同。
+        """
         try:
-            # 加载模型
-            if not hasattr(self.model, 'feature_importances_'):
-                saved_model = load_model('churn_prediction_model')
-                if saved_model:
-                    self.model = saved_model['model']
-                    self.scaler = saved_model['scaler']
-                    self.label_encoders = saved_model['label_encoders']
-                else:
-                    return {'status': 'error', 'message': '流失预测模型未训练'}
+            # 模型未发布时返回错误
+            if not self.is_loaded():
+                return [{'status': 'error', 'message': '流失预测模型未训练'} for _ in customers]
             
             # 特征准备
-            df = pd.DataFrame([customer_data])
+            df = pd.DataFrame(customers)
             X = self._prepare_churn_features(df)
             X_scaled = self.scaler.transform(X)
             
             # 预测流失概率
-            churn_probability = self.model.predict_proba(X_scaled)[0, 1]
+            probabilities = forest_predict(self.model, self.compiled_model, X_scaled, 'predict_proba')[:, 1]
             
             # 风险等级分类
-            if churn_probability >= 0.7:
-                risk_level = 'high'
-            elif churn_probability >= 0.4:
-                risk_level = 'medium'
-            else:
-                risk_level = 'low'
+            risk_levels = self._classify_risk(probabilities)
+            prediction_date = datetime.now().isoformat()
+            
+            return [
+                {
+                    'status': 'success',
+                    'customer_id': customer_data.get('customer_id'),
+                    'churn_probability': probability,
+                    'risk_level': risk_level,
+                    'prediction_date': prediction_date
+                }
+                for customer_data, probability, risk_level in zip(
+                    customers, probabilities.tolist(), risk_levels.tolist()
+                )
+            ]
+            
+        except Exception as e:
+            logger.error(f"流失概率预测失败: {e}")
+            return [{'status': 'error', 'message': str(e)} for _ in customers]
+    
+    def predict_churn_batch(self, customers: Union[List[Dict], Dict[str, List]],
+                            chunk_size: int = CHURN_BATCH_CHUNK_SIZE) -> Dict[str, Any]:
+        """批量预测客户流失概率
+        
+        customers可以是客户字典列表，也可以是按列组织的 {字段: [值, ...]} 结构。
+        数据按chunk_size分块编码、缩放并一次性调用predict_proba，控制内存峰值。
+        """
+        try:
+            if not self.is_loaded():
+                return {'status': 'error', 'message': '流失预测模型未训练'}
+            
+            df = pd.DataFrame(customers)
+            n_customers = len(df)
+            chunk_size = max(1, int(chunk_size))
+            probabilities = np.empty(n_customers, dtype=np.float64)
+            
+            # 分块向量化预测
+            for start in range(0, n_customers, chunk_size):
+                chunk = df.iloc[start:start + chunk_size]
+                X_scaled = self.scaler.transform(self._prepare_churn_features(chunk))
+                probabilities[start:start + chunk_size] = forest_predict(
+                    self.model, self.compiled_model, X_scaled, 'predict_proba'
+                )[:, 1]
+            
+            risk_levels = self._classify_risk(probabilities)
+            customer_ids = df['customer_id'].tolist() if 'customer_id' in df.columns else [None] * n_customers
+            
+            predictions = [
+                {'customer_id': customer_id, 'churn_probability': probability, 'risk_level': risk_level}
+                for customer_id, probability, risk_level in zip(
+                    customer_ids, probabilities.tolist(), risk_levels.tolist()
+                )
+            ]
             
             return {
                 'status': 'success',
-                'customer_id': customer_data.get('customer_id'),
-                'churn_probability': float(churn_probability),
-                'risk_level': risk_level,
+                'predictions': predictions,
+                'total': n_customers,
+                'risk_summary': {
+                    level: int(np.count_nonzero(risk_levels == level))
+                    for level in ('high', 'medium', 'low')
+                },
                 'prediction_date': datetime.now().isoformat()
             }
             
         except Exception as e:
-            logger.error(f"流失概率预测失败: {e}")
+            logger.error(f"批量流失概率预测失败: {e}")
             return {'status': 'error', 'message': str(e)}
     
-    def _prepare_churn_features(self, df: pd.DataFrame) -> pd.DataFrame:
-        """准备流失预测特征"""
-        features = []
-        
-        # 基础特征
-        basic_features = [
-            'days_since_last_order', 'order_frequency', 'avg_order_value',
-            'total_spent', 'days_since_last_contact', 'support_ticket_count',
-            'payment_delay_avg', 'customer_age_days'
-        ]
-        
-        for feature in basic_features:
-            if feature in df.columns:
-                features.append(feature)
-                df[feature] = df[feature].fillna(df[feature].median())
-        
-        # 分类特征编码
-        categorical_features = ['business_type', 'source_channel', 'customer_level']
-        for feature in categorical_features:
-            if feature in df.columns:
-                encoded_feature = f'{feature}_encoded'
-                if feature not in self.label_encoders:
-                    self.label_encoders[feature] = LabelEncoder()
-                    df[encoded_feature] = self.label_encoders[feature].fit_transform(df[feature].astype(str))
-                else:
-                    df[encoded_feature] = self.label_encoders[feature].transform(df[feature].astype(str))
-                features.append(encoded_feature)
-        
-        return df[features]
+    @staticmethod
+    def _classify_risk(probabilities: np.ndarray) -> np.ndarray:
+        """按流失概率划分风险等级"""
+        return np.select(
+            [probabilities >= 0.7, probabilities >= 0.4],
+            ['high', 'medium'],
+            default='low'
+        )
+    
+    def _prepare_churn_features(self, df: pd.DataFrame) -> np.ndarray:
+        """准备流失预测特征：按训练时的中位数填充缺失值、按词表编码分类特征（未训练的实例按输入数据拟合）"""
+        if self.features is None:
+            self.features = FeaturePipeline.fit(df, self.NUMERIC_FEATURES, self.CATEGORICAL_FEATURES)
+        return self.features.transform(df)
 
 # ================================================================================
 # 推荐系统
 # ================================================================================
 
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """用argpartition选出分数最高的k个下标（按分数降序）"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+class ItemVectorIndex:
+    """物品向量倒排索引 (IVF) - 纯NumPy实现
+    
+    训练时对物品向量做k-means聚类，物品按簇连续存放；查询时只对与用户向量
+    内积最高的n_probe个簇打分。n_probe越大召回越高、延迟越高，
+    n_probe >= n_lists 时等价于精确检索。
+    """
+    
+    def __init__(self, n_lists: Optional[int] = None, n_iter: int = 10, random_state: int = 42):
+        self.n_lists = n_lists
+        self.n_iter = n_iter
+        self.random_state = random_state
+        self.centroids = None
+        self.item_ids = None       # 按簇排列的物品下标
+        self.list_offsets = None   # 第i个簇对应 item_ids[list_offsets[i]:list_offsets[i+1]]
+        self.item_vectors = None   # 与item_ids对齐的连续物品向量
+    
+    def build(self, item_features: np.ndarray) -> 'ItemVectorIndex':
+        """构建索引"""
+        vectors = np.ascontiguousarray(item_features, dtype=np.float32)
+        n_items = len(vectors)
+        n_lists = self.n_lists or max(1, int(np.ceil(np.sqrt(n_items))))
+        n_lists = min(n_lists, n_items)
+        
+        # k-means聚类
+        rng = np.random.default_rng(self.random_state)
+        centroids = vectors[rng.choice(n_items, n_lists, replace=False)].copy()
+        vector_norms = np.einsum('ij,ij->i', vectors, vectors)
+        for _ in range(self.n_iter):
+            distances = (vector_norms[:, None] - 2 * vectors @ centroids.T
+                         + np.einsum('ij,ij->i', centroids, centroids)[None, :])
+            assignments = np.argmin(distances, axis=1)
+            counts = np.bincount(assignments, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        
+        self.n_lists = n_lists
+        self.centroids = centroids
+        self.item_ids = np.argsort(assignments, kind='stable')
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.item_vectors = vectors[self.item_ids]
+        return self
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """导出为普通字典保存，加载时不依赖类所在的模块路径"""
+        return dict(vars(self))
+    
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> 'ItemVectorIndex':
+        """由to_dict()的结果恢复索引"""
+        index = cls()
+        index.__dict__.update(state)
+        return index
+    
+    def search(self, user_vector: np.ndarray, k: int, n_probe: Optional[int] = None,
+               exclude_mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """检索内积最高的k个物品，返回 (物品下标, 分数)"""
+        user_vector = np.asarray(user_vector, dtype=np.float32)
+        
+        if n_probe is None or n_probe >= self.n_lists:
+            candidate_ids = self.item_ids
+            scores = self.item_vectors @ user_vector
+        else:
+            probe_lists = top_k_indices(self.centroids @ user_vector, max(1, n_probe))
+            positions = np.concatenate([
+                np.arange(self.list_offsets[i], self.list_offsets[i + 1]) for i in probe_lists
+            ])
+            candidate_ids = self.item_ids[positions]
+            scores = self.item_vectors[positions] @ user_vector
+        
+        if exclude_mask is not None:
+            keep = ~exclude_mask[candidate_ids]
+            candidate_ids, scores = candidate_ids[keep], scores[keep]
+        
+        top = top_k_indices(scores, k)
+        return candidate_ids[top], scores[top]
+
+# 预计算进程池中的共享数据，由_init_topn_worker在每个工作进程中设置一次
+_topn_worker_state: Dict[str, Any] = {}
+
+def _init_topn_worker(user_features: np.ndarray, item_features: np.ndarray,
+                      user_item_matrix: sp.csr_matrix, top_n: int) -> None:
+    """初始化预计算工作进程"""
+    _topn_worker_state.update(
+        user_features=user_features,
+        item_features=item_features,
+        user_item_matrix=user_item_matrix,
+        top_n=top_n
+    )
+
+def _score_user_block(start: int, end: int) -> Tuple[int, np.ndarray, np.ndarray]:
+    """计算一个客户分块的Top-N推荐 (分块矩阵乘法 + argpartition)"""
+    user_features = _topn_worker_state['user_features']
+    item_features = _topn_worker_state['item_features']
+    user_item_matrix = _topn_worker_state['user_item_matrix']
+    top_n = _topn_worker_state['top_n']
+    
+    scores = user_features[start:end] @ item_features.T
+    
+    # 排除已购买的商品
+    block = user_item_matrix[start:end].tocoo()
+    purchased = block.data > 0
+    scores[block.row[purchased], block.col[purchased]] = -np.inf
+    
+    n_items = scores.shape[1]
+    k = min(top_n, n_items)
+    top = np.argpartition(scores, n_items - k, axis=1)[:, n_items - k:]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    
+    # 不足top_n或已全部购买的位置用-1占位
+    items = np.full((end - start, top_n), -1, dtype=np.int32)
+    item_scores = np.full((end - start, top_n), -np.inf, dtype=np.float32)
+    valid = np.isfinite(top_scores)
+    items[:, :k] = np.where(valid, top, -1)
+    item_scores[:, :k] = top_scores
+    return start, items, item_scores
+
 class RecommendationEngine:
     """推荐系统引擎 - 基于矩阵分解"""
     
+    MODEL_NAME = 'recommendation_model'
+    
     def __init__(self):
         self.nmf_model = NMF(n_components=50, random_state=42)
         self.user_features = None
         self.item_features = None
-        self.user_item_matrix = None
+        self.user_item_matrix = None   # scipy.sparse CSR，行: 客户下标，列: 产品下标
+        self.customer_ids = None       # 有序客户ID数组，下标即矩阵行号
+        self.product_ids = None        # 有序产品ID数组，下标即矩阵列号
+        self.item_index = None
+        self.model_version = None
+        self.model_dir = None          # 当前加载的版本目录
+        self.topn_items = None         # 预计算推荐表 (内存映射)，行号即客户下标
+        self.topn_scores = None
+        self.new_customer_vector = None    # 训练后新增客户的实时打分向量（全部客户因子的均值）
+    
+    @staticmethod
+    def build_interaction_matrix(df: pd.DataFrame) -> Tuple[sp.csr_matrix, np.ndarray, np.ndarray]:
+        """由交互记录构建稀疏用户-物品矩阵
+        
+        客户和产品ID先编码为整数下标，重复交互取评分均值（与pivot_table一致），
+        返回 (CSR矩阵, 客户ID数组, 产品ID数组)。
+        """
+        df = df.dropna(subset=['rating'])
+        customer_codes, customer_ids = pd.factorize(df['customer_id'], sort=True)
+        product_codes, product_ids = pd.factorize(df['product_id'], sort=True)
         
+        ratings = df['rating'].groupby([customer_codes, product_codes]).mean()
+        matrix = sp.csr_matrix(
+            (
+                ratings.values.astype(np.float32),
+                (ratings.index.get_level_values(0), ratings.index.get_level_values(1))
+            ),
+            shape=(len(customer_ids), len(product_ids))
+        )
+        return matrix, np.asarray(customer_ids), np.asarray(product_ids)
+    
     def train(self, interaction_data: List[Dict]) -> Dict[str, Any]:
         """训练推荐模型"""
         try:
             df = pd.DataFrame(interaction_data)
             
-            # 构建用户-物品交互矩阵
-            self.user_item_matrix = df.pivot_table(
-                index='customer_id',
-                columns='product_id',
-                values='rating',
-                fill_value=0
-            )
+            # 构建稀疏用户-物品交互矩阵
+            self.user_item_matrix, self.customer_ids, self.product_ids = \
+                self.build_interaction_matrix(df)
             
             # 矩阵分解
             W = self.nmf_model.fit_transform(self.user_item_matrix)
             H = self.nmf_model.components_
             
             self.user_features = W
-            self.item_features = H.T
+            self.item_features = np.ascontiguousarray(H.T)
+            self.new_customer_vector = W.mean(axis=0)
             
-            # 计算重构误差
-            reconstructed = np.dot(W, H)
-            mse = np.mean((self.user_item_matrix.values - reconstructed) ** 2)
+            # 计算重构误差: ||X - WH||² = ||X||² - 2<X, WH> + tr((WᵀW)(HHᵀ))，无需稠密化
+            X = self.user_item_matrix.tocoo()
+            values = X.data.astype(np.float64)
+            W64, H64 = W.astype(np.float64), H.astype(np.float64)
+            cross = np.einsum('ij,ji->i', W64[X.row], H64[:, X.col]) @ values
+            squared_error = (values @ values) - 2 * cross + np.sum((W64.T @ W64) * (H64 @ H64.T))
+            mse = max(0.0, squared_error) / (X.shape[0] * X.shape[1])
             
-            # 保存模型
-            model_data = {
-                'nmf_model': self.nmf_model,
-                'user_features': self.user_features,
-                'item_features': self.item_features,
-                'user_item_matrix': self.user_item_matrix
-            }
-            save_model(model_data, 'recommendation_model')
+            # 保存模型：模型、索引和预计算推荐表写入同一个版本目录后一起发布
+            with staged_model_version(self.MODEL_NAME) as (self.model_version, staging_dir):
+                model_data = {
+                    'nmf_model': self.nmf_model,
+                    'user_features': self.user_features,
+                    'item_features': self.item_features,
+                    'user_item_matrix': self.user_item_matrix,
+                    'customer_ids': self.customer_ids,
+                    'product_ids': self.product_ids,
+                    'model_version': self.model_version
+                }
+                save_model(model_data, self.MODEL_NAME, staging_dir)
+            
+                # 构建物品向量索引，与模型文件并列保存
+                self.item_index = ItemVectorIndex().build(self.item_features)
+                save_model(self.item_index.to_dict(), 'recommendation_index', staging_dir)
+            
+                # 离线预计算所有客户的Top-N推荐
+                self.build_topn_table(staging_dir)
+            
+                self.model_dir = publish_model_version(self.MODEL_NAME, self.model_version, staging_dir)
+            self._load_topn_table()
             
             return {
                 'status': 'success',
                 'model_metrics': {
                     'reconstruction_mse': float(mse),
-                    'n_users': len(self.user_item_matrix.index),
-                    'n_items': len(self.user_item_matrix.columns)
+                    'n_users': len(self.customer_ids),
+                    'n_items': len(self.product_ids),
+                    'n_interactions': int(self.user_item_matrix.nnz)
                 },
+                'model_version': self.model_version,
                 'trained_at': datetime.now().isoformat()
             }
             
@@ -627,52 +1680,169 @@ class RecommendationEngine:
             logger.error(f"推荐模型训练失败: {e}")
             return {'status': 'error', 'message': str(e)}
     
-    def recommend(self, customer_id: int, n_recommendations: int = 10) -> Dict[str, Any]:
-        """为客户生成推荐"""
+    def build_topn_table(self, output_dir: str, top_n: int = RECOMMENDATION_TOPN_SIZE,
+                         block_size: int = RECOMMENDATION_TOPN_BLOCK_SIZE,
+                         n_workers: int = RECOMMENDATION_TOPN_WORKERS) -> None:
+        """预计算所有客户的Top-N推荐并写入内存映射表
+        
+        客户按block_size分块做矩阵乘法，分块在进程池中并行计算。结果写入尚未
+        发布的版本目录output_dir，随模型一起发布，读取方通过np.load(mmap_mode='r')共享页缓存。
+        """
+        n_users = len(self.customer_ids)
+        items_file, scores_file = self._topn_files(output_dir)
+        items_tmp = np.lib.format.open_memmap(
+            items_file, mode='w+', dtype=np.int32, shape=(n_users, top_n)
+        )
+        scores_tmp = np.lib.format.open_memmap(
+            scores_file, mode='w+', dtype=np.float32, shape=(n_users, top_n)
+        )
+        
+        worker_args = (
+            np.ascontiguousarray(self.user_features, dtype=np.float32),
+            np.ascontiguousarray(self.item_features, dtype=np.float32),
+            self.user_item_matrix,
+            top_n
+        )
+        blocks = [(start, min(start + block_size, n_users)) for start in range(0, n_users, block_size)]
+        
+        if n_workers > 1 and len(blocks) > 1:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_topn_worker,
+                                     initargs=worker_args) as executor:
+                results = executor.map(_score_user_block, *zip(*blocks))
+                for start, items, item_scores in results:
+                    items_tmp[start:start + len(items)] = items
+                    scores_tmp[start:start + len(items)] = item_scores
+        else:
+            _init_topn_worker(*worker_args)
+            for start, end in blocks:
+                _, items_tmp[start:end], scores_tmp[start:end] = _score_user_block(start, end)
+        
+        items_tmp.flush()
+        scores_tmp.flush()
+        del items_tmp, scores_tmp
+        logger.info(f"预计算推荐表已生成: {n_users}个客户, Top-{top_n}")
+    
+    @staticmethod
+    def _topn_files(directory: str) -> Tuple[str, str]:
+        """预计算推荐表文件路径"""
+        return (
+            os.path.join(directory, 'recommendation_topn_items.npy'),
+            os.path.join(directory, 'recommendation_topn_scores.npy')
+        )
+    
+    def _load_topn_table(self) -> None:
+        """以内存映射方式加载当前版本目录中的预计算推荐表"""
+        self.topn_items = self.topn_scores = None
+        items_file, scores_file = self._topn_files(self.model_dir)
+        if not os.path.exists(items_file) or not os.path.exists(scores_file):
+            return
+        self.topn_items = np.load(items_file, mmap_mode='r')
+        self.topn_scores = np.load(scores_file, mmap_mode='r')
+    
+    def load(self, version: Optional[str] = None) -> bool:
+        """加载指定版本的模型，默认加载current指针指向的版本"""
+        model_dir = resolve_model_dir(self.MODEL_NAME, version)
+        saved_model = load_model(self.MODEL_NAME, model_dir)
+        if not saved_model:
+            return False
+        
+        self.model_dir = model_dir
+        self.nmf_model = saved_model['nmf_model']
+        self.user_features = saved_model['user_features']
+        self.item_features = saved_model['item_features']
+        user_item_matrix = saved_model['user_item_matrix']
+        
+        if isinstance(user_item_matrix, pd.DataFrame):
+            # 兼容稠密pivot_table格式的旧模型
+            self.customer_ids = user_item_matrix.index.values
+            self.product_ids = user_item_matrix.columns.values
+            user_item_matrix = sp.csr_matrix(user_item_matrix.values)
+        else:
+            self.customer_ids = saved_model['customer_ids']
+            self.product_ids = saved_model['product_ids']
+        
+        self.user_item_matrix = user_item_matrix
+        self.new_customer_vector = np.asarray(self.user_features).mean(axis=0)
+        self.model_version = saved_model.get('model_version')
+        index_state = load_model('recommendation_index', model_dir)
+        self.item_index = ItemVectorIndex.from_dict(index_state) if isinstance(index_state, dict) else index_state
+        self._load_topn_table()
+        return True
+    
+    def _customer_index(self, customer_id: Any) -> Optional[int]:
+        """二分查找客户ID对应的矩阵行号，不存在时返回None"""
         try:
-            # 加载模型
+            pos = int(np.searchsorted(self.customer_ids, customer_id))
+        except TypeError:
+            return None
+        if pos < len(self.customer_ids) and self.customer_ids[pos] == customer_id:
+            return pos
+        return None
+    
+    def _purchased_mask(self, user_idx: int) -> np.ndarray:
+        """根据CSR行生成已购买商品掩码"""
+        start, end = self.user_item_matrix.indptr[user_idx:user_idx + 2]
+        purchased = self.user_item_matrix.indices[start:end][self.user_item_matrix.data[start:end] > 0]
+        mask = np.zeros(len(self.product_ids), dtype=bool)
+        mask[purchased] = True
+        return mask
+    
+    def recommend(self, customer_id: int, n_recommendations: int = 10,
+                  n_probe: Optional[int] = RECOMMENDATION_N_PROBE) -> Dict[str, Any]:
+        """为客户生成推荐
+        
+        训练时已有的客户直接读取预计算表；训练后新增的客户（不在模型中）实时打分，
+        使用全部客户因子的均值向量，即按整体偏好推荐。
+        n_probe控制索引检索的簇数，用于在召回率和延迟之间权衡；None表示精确检索。
+        """
+        try:
+            # 模型未发布时返回错误
             if self.user_features is None:
-                saved_model = load_model('recommendation_model')
-                if saved_model:
-                    self.nmf_model = saved_model['nmf_model']
-                    self.user_features = saved_model['user_features']
-                    self.item_features = saved_model['item_features']
-                    self.user_item_matrix = saved_model['user_item_matrix']
-                else:
-                    return {'status': 'error', 'message': '推荐模型未训练'}
-            
-            if customer_id not in self.user_item_matrix.index:
-                return {'status': 'error', 'message': '客户不存在'}
+                return {'status': 'error', 'message': '推荐模型未训练'}
+            
+            if self.item_index is None:
+                # 兼容没有索引文件的旧模型
+                self.item_index = ItemVectorIndex().build(self.item_features)
             
             # 获取用户索引
-            user_idx = self.user_item_matrix.index.get_loc(customer_id)
-            
-            # 计算推荐分数
-            user_vector = self.user_features[user_idx]
-            scores = np.dot(user_vector, self.item_features.T)
-            
-            # 排除已购买的商品
-            purchased_items = self.user_item_matrix.loc[customer_id]
-            purchased_mask = purchased_items > 0
-            scores[purchased_mask] = -np.inf
-            
-            # 获取Top-N推荐
-            top_indices = np.argsort(scores)[::-1][:n_recommendations]
-            top_items = self.user_item_matrix.columns[top_indices]
-            top_scores = scores[top_indices]
-            
-            recommendations = []
-            for item_id, score in zip(top_items, top_scores):
-                recommendations.append({
-                    'product_id': str(item_id),
-                    'score': float(score),
-                    'confidence': min(1.0, max(0.0, score / np.max(scores) if np.max(scores) > 0 else 0))
-                })
+            user_idx = self._customer_index(customer_id)
+            if user_idx is None:
+                # 新客户没有购买记录，实时打分
+                source = 'live'
+                top_indices, top_scores = self.item_index.search(
+                    self.new_customer_vector, n_recommendations, n_probe=n_probe
+                )
+            elif (self.topn_items is not None and user_idx < len(self.topn_items)
+                    and n_recommendations <= self.topn_items.shape[1]):
+                # 直接读取预计算结果
+                source = 'precomputed'
+                top_indices = np.asarray(self.topn_items[user_idx, :n_recommendations])
+                top_scores = np.asarray(self.topn_scores[user_idx, :n_recommendations])
+                valid = top_indices >= 0
+                top_indices, top_scores = top_indices[valid], top_scores[valid]
+            else:
+                # 超出预计算表Top-N范围的请求实时打分（排除已购买的商品）
+                source = 'live'
+                top_indices, top_scores = self.item_index.search(
+                    self.user_features[user_idx], n_recommendations, n_probe=n_probe,
+                    exclude_mask=self._purchased_mask(user_idx)
+                )
+            top_items = self.product_ids[top_indices]
+            max_score = top_scores[0] if len(top_scores) else 0
+            confidences = np.clip(top_scores / max_score, 0.0, 1.0) if max_score > 0 else np.zeros(len(top_scores))
+            
+            recommendations = [
+                {'product_id': item_id, 'score': score, 'confidence': confidence}
+                for item_id, score, confidence in zip(
+                    top_items.astype(str).tolist(), top_scores.tolist(), confidences.tolist()
+                )
+            ]
             
             return {
                 'status': 'success',
                 'customer_id': customer_id,
                 'recommendations': recommendations,
+                'source': source,
                 'generated_at': datetime.now().isoformat()
             }
             
@@ -684,16 +1854,170 @@ class RecommendationEngine:
 # Flask API路由
 # ================================================================================
 
-# 全局模型实例
-sales_predictor = SalesTrendPredictor()
-behavior_predictor = CustomerBehaviorPredictor()
-churn_predictor = ChurnPredictor()
-recommendation_engine = RecommendationEngine()
+# 模型注册中心：启动时并行预加载，训练完成后热切换，其他工作进程通过current版本指针发现新版本
+MODEL_CLASSES = {
+    'sales_trend': SalesTrendPredictor,
+    'customer_behavior': CustomerBehaviorPredictor,
+    'churn': ChurnPredictor,
+    'recommendation': RecommendationEngine,
+    'sales_series': MultiSeriesSalesForecaster,
+}
+
+model_registry = ModelRegistry()
+for _name, _model_class in MODEL_CLASSES.items():
+    model_registry.register(
+        _name, _model_class,
+        version_source=lambda model_class=_model_class: current_model_version(model_class.MODEL_NAME)
+    )
+
+# 推理进程池（生产模式下每个工作进程一个）：预测在推理进程中执行，请求线程只做I/O
+inference_pool: Optional[ProcessPoolExecutor] = None
+
+def _init_inference_worker() -> None:
+    """推理进程初始化：预加载全部模型（大数组以内存映射方式加载，与其他进程共享页缓存）"""
+    model_registry.preload()
+
+def _inference_task(model_name: str, version: Optional[str], method: str,
+                    args: tuple, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """在推理进程中执行预测，使用与请求进程相同的模型版本"""
+    predictor = model_registry.get(model_name)
+    if version is not None and getattr(predictor, 'model_version', None) != version:
+        instance = model_registry.create(model_name)
+        if instance.load(version):
+            model_registry.publish(model_name, instance)
+            predictor = instance
+    return getattr(predictor, method)(*args, **kwargs)
+
+def start_inference_pool(n_workers: int) -> None:
+    """在当前工作进程中创建推理进程池（spawn启动，不继承工作进程的线程和锁）"""
+    global inference_pool
+    if n_workers > 0 and inference_pool is None:
+        inference_pool = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=mp.get_context('spawn'),
+            initializer=_init_inference_worker
+        )
+        # 提交空任务立即启动全部推理进程，模型加载不计入首批请求的延迟
+        for _ in range(n_workers):
+            inference_pool.submit(os.getpid)
+        logger.info(f"推理进程池已创建: {n_workers}个进程")
+
+def run_inference(model_name: str, predictor: Any, method: str, *args, **kwargs) -> Dict[str, Any]:
+    """调用预测器方法：有推理进程池时提交到进程池执行，否则在当前线程执行"""
+    if inference_pool is None:
+        return getattr(predictor, method)(*args, **kwargs)
+    version = getattr(predictor, 'model_version', None)
+    return inference_pool.submit(_inference_task, model_name, version, method, args, kwargs).result()
+
+def predict_coalesced(model_name: str, method: str, customers: List[Dict]) -> List[Dict[str, Any]]:
+    """微批处理的批量函数：一批单客户请求调用一次 method（predict_each类方法）
+    
+    有客户预测失败（如字段类型错误）时整批逐条重新预测，错误只返回给对应的请求。
+    """
+    predictor = model_registry.get(model_name)
+    results = run_inference(model_name, predictor, method, customers)
+    if len(customers) > 1 and any(result.get('status') != 'success' for result in results):
+        results = [run_inference(model_name, predictor, method, [customer_data])[0] for customer_data in customers]
+    return results
+
+prediction_batchers = {
+    model_name: MicroBatcher(
+        lambda customers, model_name=model_name, method=method: predict_coalesced(model_name, method, customers),
+        max_batch_size=MICRO_BATCH_MAX_SIZE,
+        max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+        max_concurrency=MICRO_BATCH_CONCURRENCY,
+        name=f"micro-batch-{model_name}"
+    )
+    for model_name, method in (('churn', 'predict_churn_each'), ('customer_behavior', 'predict_each'))
+}
+
+def run_training(model_name: str, data: Optional[Union[List[Dict], pd.DataFrame]], **kwargs) -> Dict[str, Any]:
+    """在训练进程中训练模型，模型文件由train()保存；data为None时在训练进程中从数据库流式读取"""
+    if data is None:
+        try:
+            data = load_training_data(model_name)
+        except Exception as e:
+            logger.error(f"训练数据读取失败 [{model_name}]: {e}")
+            return {'status': 'error', 'message': f"训练数据读取失败: {e}"}
+        if data.empty:
+            return {'status': 'error', 'message': '训练数据为空'}
+    return model_registry.create(model_name).train(data, **kwargs)
+
+def publish_trained_model(model_name: str, result: Dict[str, Any]) -> None:
+    """训练任务成功后在服务进程中加载新模型版本并发布"""
+    predictor = model_registry.create(model_name)
+    if predictor.load(result.get('model_version')):
+        model_registry.publish(model_name, predictor)
+        invalidate_cache(model_name)
+
+# 后台训练任务队列，任务记录同步写入Redis供其他工作进程查询
+training_jobs = TrainingJobQueue(
+    max_workers=TRAINING_MAX_WORKERS,
+    max_pending=TRAINING_MAX_PENDING,
+    on_success=publish_trained_model,
+    persist=lambda job: set_cached_result(cache_key('training_job', id=job['job_id']), job, ttl=86400),
+    fetch=lambda job_id: get_cached_result(cache_key('training_job', id=job_id))
+)
+
+def is_columnar_request() -> bool:
+    """请求体是否为列式二进制格式（Arrow / npz）"""
+    return request.mimetype in COLUMNAR_CONTENT_TYPES
+
+def request_options() -> Dict[str, Any]:
+    """请求参数：JSON请求取自请求体，列式请求体时取自URL查询参数"""
+    if is_columnar_request():
+        return parse_query_options(request.args)
+    return request.get_json(silent=True) or {}
+
+def request_customers() -> Optional[Union[List[Dict], pd.DataFrame]]:
+    """批量预测的客户数据：列式请求体直接解码；请求中只给customer_ids时从客户特征表读取"""
+    if is_columnar_request():
+        return decode_frame(request.get_data(), request.mimetype)
+    
+    customers = request.json.get('customers')
+    customer_ids = request.json.get('customer_ids')
+    if customers or not customer_ids:
+        return customers
+    
+    conn = get_connection()
+    try:
+        return load_customer_features(conn, customer_ids)
+    finally:
+        conn.close()
+
+def request_training_data() -> Optional[Union[List[Dict], pd.DataFrame]]:
+    """训练请求的数据：列式请求体直接解码；source为database时返回None，由训练进程直接从数据库读取"""
+    if is_columnar_request():
+        return decode_frame(request.get_data(), request.mimetype)
+    if request.json.get('source') == 'database':
+        return None
+    return request.json.get('data', [])
+
+def submit_training(model_name: str, data: Optional[Union[List[Dict], pd.DataFrame]], **kwargs):
+    """提交后台训练任务并立即返回任务ID；请求中wait为true时等待训练完成并返回训练结果"""
+    job = training_jobs.submit(model_name, run_training, model_name, data, **kwargs)
+    if job is None:
+        return jsonify({'status': 'error', 'message': '训练任务队列已满，请稍后重试'}), 429
+    if job['status'] == 'error':
+        return jsonify(job['result']), 500
+    
+    if request_options().get('wait', False):
+        job = training_jobs.wait(job['job_id'])
+        return jsonify(job['result'])
+    
+    return jsonify({
+        'status': 'accepted',
+        'job_id': job['job_id'],
+        'job_url': f"/jobs/{job['job_id']}",
+        'submitted_at': job['submitted_at']
+    }), 202
 
 @app.before_request
 def before_request():
     """请求前处理"""
     g.start_time = datetime.now()
+    if is_columnar_request() and request.mimetype not in supported_content_types():
+        return jsonify({'status': 'error', 'message': f"不支持的请求体格式: {request.mimetype}"}), 415
 
 @app.after_request
 def after_request(response):
@@ -710,8 +2034,11 @@ def health_check():
         # 检查Redis连接
         redis_status = 'connected' if redis_client and redis_client.ping() else 'disconnected'
         
-        # 检查模型文件
-        model_files = os.listdir(MODEL_PATH) if os.path.exists(MODEL_PATH) else []
+        # 检查已发布的模型
+        available_models = sum(
+            1 for model_class in MODEL_CLASSES.values()
+            if model_artifact_status(model_class.MODEL_NAME)['status'] == 'trained'
+        )
         
         return jsonify({
             'status': 'healthy',
@@ -719,7 +2046,8 @@ def health_check():
             'version': '1.0.0',
             'timestamp': datetime.now().isoformat(),
             'redis_status': redis_status,
-            'available_models': len(model_files),
+            'available_models': available_models,
+            'cache_stats': dict(cache_stats),
             'uptime': 'unknown'  # 可以添加服务启动时间计算
         })
     except Exception as e:
@@ -732,12 +2060,11 @@ def health_check():
 def train_sales_trend():
     """训练销售趋势预测模型"""
     try:
-        data = request.json.get('data', [])
-        if not data:
+        data = request_training_data()
+        if data is not None and len(data) == 0:
             return jsonify({'status': 'error', 'message': '训练数据为空'}), 400
         
-        result = sales_predictor.train(data)
-        return jsonify(result)
+        return submit_training('sales_trend', data)
     except Exception as e:
         logger.error(f"销售趋势训练API错误: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -748,36 +2075,66 @@ def predict_sales_trend():
     try:
         future_periods = request.json.get('future_periods', 3)
         features = request.json.get('features', {})
+        uncertainty = request.json.get('uncertainty', SALES_UNCERTAINTY_MODE)
+        predictor = model_registry.get('sales_trend')
         
-        # 检查缓存
-        cache_key_str = cache_key('sales_trend', periods=future_periods)
-        cached_result = get_cached_result(cache_key_str)
-        if cached_result:
-            return jsonify(cached_result)
-        
-        result = sales_predictor.predict(future_periods, features)
+        result = cached_predict(
+            'sales_trend', predictor,
+            {'future_periods': future_periods, 'features': features, 'uncertainty': uncertainty},
+            lambda: run_inference('sales_trend', predictor, 'predict', future_periods, features, uncertainty)
+        )
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"销售趋势预测API错误: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/models/sales_series/train', methods=['POST'])
+def train_sales_series():
+    """训练多序列销售预测模型（按部门、销售人员、来源渠道分组）"""
+    try:
+        data = request_training_data()
+        dimensions = request_options().get('dimensions')
+        if data is not None and len(data) == 0:
+            return jsonify({'status': 'error', 'message': '训练数据为空'}), 400
+        if dimensions and not set(dimensions) <= set(SALES_SERIES_DIMENSIONS):
+            return jsonify({'status': 'error', 'message': f"分组维度只支持: {', '.join(SALES_SERIES_DIMENSIONS)}"}), 400
         
-        # 缓存结果
-        if result['status'] == 'success':
-            set_cached_result(cache_key_str, result, ttl=3600)  # 1小时缓存
+        return submit_training('sales_series', data, dimensions=dimensions)
+    except Exception as e:
+        logger.error(f"多序列销售预测训练API错误: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/models/sales_series/predict_batch', methods=['POST'])
+def predict_sales_series_batch():
+    """批量返回各分组的销售预测"""
+    try:
+        future_periods = request.json.get('future_periods', 3)
+        uncertainty = request.json.get('uncertainty', SALES_UNCERTAINTY_MODE)
+        dimension = request.json.get('dimension')
+        groups = request.json.get('groups')
+        predictor = model_registry.get('sales_series')
         
+        result = cached_predict(
+            'sales_series', predictor,
+            {'future_periods': future_periods, 'uncertainty': uncertainty, 'dimension': dimension, 'groups': groups},
+            lambda: run_inference('sales_series', predictor, 'predict_batch', future_periods, uncertainty, dimension, groups)
+        )
         return jsonify(result)
     except Exception as e:
-        logger.error(f"销售趋势预测API错误: {e}")
+        logger.error(f"多序列销售预测API错误: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/models/customer_behavior/train', methods=['POST'])
 def train_customer_behavior():
     """训练客户行为预测模型"""
     try:
-        data = request.json.get('data', [])
-        target = request.json.get('target', 'customer_value')
+        data = request_training_data()
+        target = request_options().get('target', 'customer_value')
         
-        if not data:
+        if data is not None and len(data) == 0:
             return jsonify({'status': 'error', 'message': '训练数据为空'}), 400
         
-        result = behavior_predictor.train(data, target)
-        return jsonify(result)
+        return submit_training('customer_behavior', data, target_column=target)
     except Exception as e:
         logger.error(f"客户行为训练API错误: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -790,22 +2147,39 @@ def predict_customer_behavior():
         if not customer_data:
             return jsonify({'status': 'error', 'message': '客户数据为空'}), 400
         
-        result = behavior_predictor.predict(customer_data)
+        predictor = model_registry.get('customer_behavior')
+        result = cached_predict(
+            'customer_behavior', predictor, customer_data,
+            lambda: prediction_batchers['customer_behavior'].submit(customer_data)
+        )
         return jsonify(result)
     except Exception as e:
         logger.error(f"客户行为预测API错误: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/models/customer_behavior/predict_batch', methods=['POST'])
+def predict_customer_behavior_batch():
+    """批量预测客户行为"""
+    try:
+        customers = request_customers()
+        if customers is None or len(customers) == 0:
+            return jsonify({'status': 'error', 'message': '客户数据为空'}), 400
+        
+        result = run_inference('customer_behavior', model_registry.get('customer_behavior'), 'predict_many', customers)
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"批量客户行为预测API错误: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/models/churn/train', methods=['POST'])
 def train_churn_model():
     """训练客户流失预测模型"""
     try:
-        data = request.json.get('data', [])
-        if not data:
+        data = request_training_data()
+        if data is not None and len(data) == 0:
             return jsonify({'status': 'error', 'message': '训练数据为空'}), 400
         
-        result = churn_predictor.train(data)
-        return jsonify(result)
+        return submit_training('churn', data)
     except Exception as e:
         logger.error(f"流失预测训练API错误: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -818,22 +2192,40 @@ def predict_churn():
         if not customer_data:
             return jsonify({'status': 'error', 'message': '客户数据为空'}), 400
         
-        result = churn_predictor.predict_churn_probability(customer_data)
+        predictor = model_registry.get('churn')
+        result = cached_predict(
+            'churn', predictor, customer_data,
+            lambda: prediction_batchers['churn'].submit(customer_data)
+        )
         return jsonify(result)
     except Exception as e:
         logger.error(f"流失预测API错误: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/models/churn/predict_batch', methods=['POST'])
+def predict_churn_batch():
+    """批量预测客户流失概率"""
+    try:
+        customers = request_customers()
+        chunk_size = request_options().get('chunk_size', CHURN_BATCH_CHUNK_SIZE)
+        if customers is None or len(customers) == 0:
+            return jsonify({'status': 'error', 'message': '客户数据为空'}), 400
+        
+        result = run_inference('churn', model_registry.get('churn'), 'predict_churn_batch', customers, chunk_size)
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"批量流失预测API错误: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/models/recommendation/train', methods=['POST'])
 def train_recommendation():
     """训练推荐模型"""
     try:
-        data = request.json.get('data', [])
-        if not data:
+        data = request_training_data()
+        if data is not None and len(data) == 0:
             return jsonify({'status': 'error', 'message': '训练数据为空'}), 400
         
-        result = recommendation_engine.train(data)
-        return jsonify(result)
+        return submit_training('recommendation', data)
     except Exception as e:
         logger.error(f"推荐模型训练API错误: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -844,50 +2236,100 @@ def get_recommendations():
     try:
         customer_id = request.json.get('customer_id')
         n_recommendations = request.json.get('n_recommendations', 10)
+        n_probe = request.json.get('n_probe', RECOMMENDATION_N_PROBE)
         
         if not customer_id:
             return jsonify({'status': 'error', 'message': '客户ID为空'}), 400
         
-        result = recommendation_engine.recommend(customer_id, n_recommendations)
+        predictor = model_registry.get('recommendation')
+        result = cached_predict(
+            'recommendation', predictor,
+            {'customer_id': customer_id, 'n_recommendations': n_recommendations, 'n_probe': n_probe},
+            lambda: run_inference('recommendation', predictor, 'recommend', customer_id, n_recommendations, n_probe)
+        )
         return jsonify(result)
     except Exception as e:
         logger.error(f"推荐API错误: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_training_job(job_id: str):
+    """查询训练任务状态、耗时和训练指标"""
+    try:
+        job = training_jobs.get(job_id)
+        if not job:
+            return jsonify({'status': 'error', 'message': '训练任务不存在'}), 404
+        
+        return jsonify({'status': 'success', 'job': job})
+    except Exception as e:
+        logger.error(f"训练任务查询错误: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+def model_artifact_status(model_name: str) -> Dict[str, Any]:
+    """模型的已发布版本、版本目录大小和发布时间"""
+    version = current_model_version(model_name)
+    if version:
+        model_dir = model_version_dir(model_name, version)
+        pointer_file = os.path.join(MODEL_PATH, model_name, MODEL_POINTER_FILE)
+        try:
+            files = [os.path.join(model_dir, name) for name in os.listdir(model_dir)]
+            file_size = sum(os.path.getsize(f) for f in files)
+            last_modified = os.stat(pointer_file).st_mtime
+        except FileNotFoundError:
+            # current指向的版本目录不存在（被手动删除或发布中途崩溃），报告而不是让状态接口失败
+            return {
+                'status': 'missing',
+                'version': version,
+                'versions': list_model_versions(model_name),
+                'message': f"版本目录不存在: {model_dir}",
+                'file_size': 0,
+                'last_modified': None
+            }
+    else:
+        # 兼容未分版本目录的旧模型文件
+        files = [os.path.join(MODEL_PATH, f"{model_name}.pkl")]
+        files = [f for f in files if os.path.exists(f)]
+        file_size = sum(os.path.getsize(f) for f in files)
+        last_modified = os.stat(files[0]).st_mtime if files else None
+    
+    return {
+        'status': 'trained' if files else 'not_trained',
+        'version': version,
+        'versions': list_model_versions(model_name),
+        'file_size': file_size,
+        'last_modified': datetime.fromtimestamp(last_modified).isoformat() if last_modified else None
+    }
+
+@app.route('/features/customers/refresh', methods=['POST'])
+def refresh_customer_feature_table():
+    """刷新客户特征表（默认增量刷新，full为true时全量重建）"""
+    try:
+        full = bool((request.get_json(silent=True) or {}).get('full', False))
+        conn = get_connection()
+        try:
+            result = refresh_customer_features(conn, full=full)
+        finally:
+            conn.close()
+        return jsonify({'status': 'success', **result})
+    except Exception as e:
+        logger.error(f"客户特征刷新API错误: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/models/status', methods=['GET'])
 def models_status():
     """获取所有模型状态"""
     try:
-        models_info = {}
-        
-        # 检查模型文件
-        model_files = {
-            'sales_trend': 'sales_trend_model.pkl',
-            'customer_behavior': 'customer_behavior_model.pkl',
-            'churn_prediction': 'churn_prediction_model.pkl',
-            'recommendation': 'recommendation_model.pkl'
+        models_info = {
+            model_name: model_artifact_status(model_class.MODEL_NAME)
+            for model_name, model_class in MODEL_CLASSES.items()
         }
         
-        for model_name, file_name in model_files.items():
-            file_path = os.path.join(MODEL_PATH, file_name)
-            if os.path.exists(file_path):
-                stat_info = os.stat(file_path)
-                models_info[model_name] = {
-                    'status': 'trained',
-                    'file_size': stat_info.st_size,
-                    'last_modified': datetime.fromtimestamp(stat_info.st_mtime).isoformat()
-                }
-            else:
-                models_info[model_name] = {
-                    'status': 'not_trained',
-                    'file_size': 0,
-                    'last_modified': None
-                }
-        
         return jsonify({
             'status': 'success',
             'models': models_info,
             'model_path': MODEL_PATH,
+            'registry': model_registry.status(),
+            'micro_batching': {name: batcher.status() for name, batcher in prediction_batchers.items()},
             'checked_at': datetime.now().isoformat()
         })
     except Exception as e:
@@ -903,13 +2345,46 @@ def internal_error(error):
     return jsonify({'status': 'error', 'message': '服务器内部错误'}), 500
 
 if __name__ == '__main__':
-    logger.info("启动CRM机器学习服务...")
+    parser = argparse.ArgumentParser(description='CRM机器学习服务')
+    parser.add_argument('--mode', choices=('dev', 'production'), default=ML_SERVE_MODE,
+                        help='dev: Flask开发服务器; production: 预fork的Gunicorn + 推理进程池')
+    parser.add_argument('--workers', type=int, default=ML_SERVE_WORKERS, help='生产模式的工作进程数')
+    parser.add_argument('--threads', type=int, default=ML_SERVE_THREADS, help='生产模式每个工作进程的请求线程数')
+    parser.add_argument('--inference-workers', type=int, default=INFERENCE_WORKERS,
+                        help='生产模式每个工作进程的推理进程数（默认按CPU核心数平均分配，0表示不使用推理进程池）')
+    parser.add_argument('--gunicorn-config', default=os.getenv('GUNICORN_CONFIG'),
+                        help='生产模式的Gunicorn配置文件（日志、请求限制等）')
+    args = parser.parse_args()
+    
+    host = '0.0.0.0'
+    port = int(os.getenv('ML_SERVICE_PORT', 5001))
+    logger.info(f"启动CRM机器学习服务 ({args.mode})...")
     logger.info(f"模型存储路径: {MODEL_PATH}")
     
-    # 启动Flask应用
-    app.run(
-        host='0.0.0.0',
-        port=int(os.getenv('ML_SERVICE_PORT', 5001)),
-        debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true',
-        threaded=True
-    )
+    # 预加载模型（须在模块导入完成后进行，反序列化时需要导入本模块中的类）；
+    # 生产模式下在fork之前完成，工作进程共享已加载的模型
+    model_registry.preload()
+    
+    if args.mode == 'production':
+        from serving import serve_production
+        
+        inference_workers = args.inference_workers
+        if inference_workers is None:
+            inference_workers = max(1, (os.cpu_count() or 1) // max(1, args.workers))
+        
+        def on_worker_start() -> None:
+            start_inference_pool(inference_workers)
+            model_registry.watch(MODEL_WATCH_INTERVAL)
+        
+        serve_production(
+            app, host, port, args.workers, args.threads, on_worker_start,
+            timeout=ML_SERVE_TIMEOUT, config_file=args.gunicorn_config
+        )
+    else:
+        model_registry.watch(MODEL_WATCH_INTERVAL)
+        app.run(
+            host=host,
+            port=port,
+            debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true',
+            threaded=True
+        )
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - JSON序列化
+
+HTTP响应（jsonify）和Redis缓存值统一通过这里的序列化器编码：
+
+- orjson（默认，已安装时）：C实现，直接序列化NumPy数组和NumPy标量，无需逐个float()转换
+- json（标准库，回退）：通过default钩子把NumPy数组、标量转换为Python对象
+
+通过环境变量 JSON_SERIALIZER=orjson|json 选择；指定orjson但未安装时回退到标准库。
+两种实现的输出兼容：NaN和无穷大编码为null，datetime编码为ISO格式字符串，
+其他无法直接编码的对象转为字符串。
+"""
+
+import os
+import json
+import math
+import logging
+from datetime import date, datetime
+from typing import Any, Union
+
+import numpy as np
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _default(obj: Any) -> Any:
+    """两种序列化器共用的回退转换"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _replace_non_finite(obj: Any) -> Any:
+    """把NaN、无穷大替换为None（标准库json会输出非法的NaN字面量）"""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        obj = _default(obj)
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _replace_non_finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_replace_non_finite(value) for value in obj]
+    return obj
+
+
+class OrjsonSerializer:
+    """orjson序列化器"""
+
+    name = 'orjson'
+    options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=self.options)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+
+class StdlibSerializer:
+    """标准库json序列化器"""
+
+    name = 'json'
+
+    def dumps(self, obj: Any) -> bytes:
+        try:
+            text = json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+        except ValueError:
+            # 含NaN或无穷大时（少见）再遍历一次替换为null
+            text = json.dumps(_replace_non_finite(obj), default=_default, ensure_ascii=False, separators=(',', ':'))
+        return text.encode('utf-8')
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+
+def get_serializer(name: str = None):
+    """按名称创建序列化器，orjson不可用时回退到标准库"""
+    name = name or os.getenv('JSON_SERIALIZER', 'orjson')
+    if name == 'orjson' and orjson is not None:
+        return OrjsonSerializer()
+    if name == 'orjson':
+        logger.warning("未安装orjson，使用标准库json序列化")
+    return StdlibSerializer()
+
+
+serializer = get_serializer()
+
+
+class SerializerJSONProvider(JSONProvider):
+    """Flask的JSON提供者：jsonify和request.json使用同一个序列化器"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return serializer.dumps(obj).decode('utf-8')
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        return serializer.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        # 直接以字节作为响应体，省去一次解码和重新编码
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(serializer.dumps(obj), mimetype='application/json')
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - ML服务生产模式
+
+python python_ml_service.py --mode production 以预fork的Gunicorn服务器运行服务：
+
+    master（Gunicorn arbiter）
+      │  导入服务模块并预加载全部模型后fork，工作进程共享模型的只读内存页
+      ├── 工作进程 × workers（gthread）
+      │     ├── 请求线程 × threads：解析请求、读写Redis和数据库、序列化响应，
+      │     │   等待网络和I/O时释放GIL，慢I/O不阻塞其他请求
+      │     ├── Redis写入线程：缓存写入在后台完成，响应不等待Redis
+      │     ├── 模型版本监视线程
+      │     └── 推理进程池 × inference_workers（spawn启动，各自以内存映射加载模型）：
+      │           sklearn/XGBoost/Prophet的CPU计算在这里执行，不占用请求线程所在进程的GIL
+      └── ...
+
+workers × inference_workers 一般取CPU核心数；预测结果缓存命中的请求不进入推理进程池。
+Gunicorn的日志、请求限制等配置可以通过 --gunicorn-config 指定的配置文件提供，
+命令行参数（绑定地址、进程数、线程数）优先。
+"""
+
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger(__name__)
+
+
+class ProductionServer(BaseApplication):
+    """以编程方式配置的Gunicorn服务器"""
+
+    def __init__(self, application: Any, options: Dict[str, Any], config_file: Optional[str] = None):
+        self.application = application
+        self.options = options
+        self.config_file = config_file
+        super().__init__()
+
+    def load_config(self) -> None:
+        if self.config_file:
+            self.load_config_from_file(self.config_file)
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self) -> Any:
+        return self.application
+
+
+def serve_production(application: Any, host: str, port: int, workers: int, threads: int,
+                     on_worker_start: Callable[[], None], timeout: int = 120,
+                     config_file: Optional[str] = None) -> None:
+    """启动预fork服务器（阻塞直到服务器退出）
+
+    on_worker_start: 每个工作进程fork之后、开始处理请求之前调用，用于启动推理进程池和版本监视
+    """
+    options = {
+        'bind': f"{host}:{port}",
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': threads,
+        'preload_app': True,
+        'timeout': timeout,
+        'post_fork': lambda server, worker: on_worker_start(),
+    }
+    logger.info(f"生产模式启动: {workers}个工作进程 x {threads}个请求线程, 监听 {host}:{port}")
+    ProductionServer(application, options, config_file).run()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - 后台训练任务队列
+
+训练任务提交到有界进程池中异步执行，接口立即返回任务ID，调用方通过任务ID
+查询状态、耗时和训练指标。进程池大小限制了同时训练的任务数，排队任务数也有
+上限，训练进程以较低优先级运行，避免挤占预测接口的CPU。
+
+训练进程以spawn方式启动：生产模式下队列在多线程的gthread工作进程中创建，fork会把
+其他线程持有的锁（日志、Redis客户端等）原样复制到子进程，可能导致训练进程死锁。
+进程数和排队上限只约束创建队列的进程，多个Gunicorn工作进程各有一个队列。
+
+训练进程开始执行任务时通过进程间队列通知主进程，任务状态此时才变为running
+（任务在进程池的调用队列中等待时仍为queued）。训练进程异常退出（如被OOM终止）
+会使整个进程池失效，下次提交时重建进程池。
+"""
+
+import os
+import time
+import uuid
+import logging
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+# 训练进程中的任务开始通知队列（进程初始化时设置）
+_started_queue = None
+
+
+def _init_worker(niceness: int, started_queue) -> None:
+    """训练进程初始化：降低调度优先级，保存任务开始通知队列"""
+    global _started_queue
+    _started_queue = started_queue
+    try:
+        os.nice(niceness)
+    except (AttributeError, OSError):
+        pass
+
+
+def _execute_job(job_id: str, train_fn: Callable[..., Dict[str, Any]], args: tuple,
+                 kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """在训练进程中执行任务，通知主进程任务已开始，并记录实际开始和结束时间"""
+    started_at = datetime.now().isoformat()
+    if _started_queue is not None:
+        _started_queue.put((job_id, started_at))
+    start = time.perf_counter()
+    result = train_fn(*args, **kwargs)
+    return {
+        'result': result,
+        'started_at': started_at,
+        'duration_seconds': time.perf_counter() - start
+    }
+
+
+class TrainingJobQueue:
+    """有界的后台训练任务队列"""
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 8, niceness: int = 10,
+                 max_history: int = 200,
+                 on_success: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 persist: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 fetch: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None):
+        """
+        on_success: 任务成功后在主进程中回调 (model_name, result)，用于发布新模型
+        persist/fetch: 可选的任务记录外部存储（如Redis），便于多个工作进程共享任务状态
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.niceness = niceness
+        self.max_history = max_history
+        self.on_success = on_success
+        self.persist = persist
+        self.fetch = fetch
+        self._executor = None
+        self._started = None
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._done: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """按需创建进程池（避免在模块导入时启动子进程）"""
+        if self._executor is None:
+            context = mp.get_context('spawn')
+            if self._started is None:
+                self._started = context.SimpleQueue()
+                threading.Thread(target=self._watch_started, name='training-job-started', daemon=True).start()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self.niceness, self._started)
+            )
+        return self._executor
+
+    def _reset_executor(self) -> None:
+        """丢弃失效的进程池，下次提交时重建"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _watch_started(self) -> None:
+        """接收训练进程的任务开始通知，更新任务状态为running"""
+        while True:
+            job_id, started_at = self._started.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job['status'] != 'queued':
+                    continue
+                job.update(status='running', started_at=started_at)
+                snapshot = dict(job)
+            self._persist(snapshot)
+
+    def submit(self, model_name: str, train_fn: Callable[..., Dict[str, Any]],
+               *args, **kwargs) -> Optional[Dict[str, Any]]:
+        """提交训练任务，队列已满时返回None；进程池不可用时返回状态为error的任务记录"""
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if job['status'] in ACTIVE_STATUSES)
+            if active >= self.max_pending:
+                return None
+
+            job_id = uuid.uuid4().hex
+            job = {
+                'job_id': job_id,
+                'model': model_name,
+                'status': 'queued',
+                'submitted_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'duration_seconds': None,
+                'result': None
+            }
+            future = self._submit_to_pool(job_id, train_fn, args, kwargs)
+            if future is None:
+                job.update(
+                    status='error',
+                    finished_at=datetime.now().isoformat(),
+                    result={'status': 'error', 'message': '训练进程池不可用，任务提交失败'}
+                )
+            self._prune_history()
+            self._jobs[job_id] = job
+            self._done[job_id] = threading.Event()
+            if future is None:
+                self._done[job_id].set()
+            snapshot = dict(job)
+
+        self._persist(snapshot)
+        if future is None:
+            return snapshot
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        logger.info(f"训练任务已提交: {model_name} ({job_id})")
+        return snapshot
+
+    def _submit_to_pool(self, job_id: str, train_fn: Callable[..., Dict[str, Any]],
+                        args: tuple, kwargs: Dict[str, Any]) -> Optional[Future]:
+        """提交到进程池；进程池已失效（BrokenProcessPool）或提交失败时重建进程池并重试一次"""
+        for attempt in range(2):
+            try:
+                return self._get_executor().submit(_execute_job, job_id, train_fn, args, kwargs)
+            except Exception as e:
+                logger.warning(f"训练任务提交失败{'，重建进程池后重试' if attempt == 0 else ''}: {e}")
+                self._reset_executor()
+        return None
+
+    def _finish(self, job_id: str, future: Future) -> None:
+        """任务结束回调"""
+        with self._lock:
+            job = self._jobs[job_id]
+            job['finished_at'] = datetime.now().isoformat()
+            try:
+                outcome = future.result()
+                job.update(
+                    result=outcome['result'],
+                    started_at=outcome['started_at'],
+                    duration_seconds=outcome['duration_seconds'],
+                    status='success' if outcome['result'].get('status') == 'success' else 'error'
+                )
+            except BrokenProcessPool as e:
+                job.update(status='error', result={'status': 'error', 'message': f'训练进程异常退出: {e}'})
+            except Exception as e:
+                job.update(status='error', result={'status': 'error', 'message': str(e)})
+            snapshot = dict(job)
+
+        logger.info(f"训练任务结束: {snapshot['model']} ({job_id}) - {snapshot['status']}")
+        if snapshot['status'] == 'success' and self.on_success:
+            try:
+                self.on_success(snapshot['model'], snapshot['result'])
+            except Exception as e:
+                logger.error(f"训练任务完成回调失败: {e}")
+        self._persist(snapshot)
+        self._done[job_id].set()
+
+    def _prune_history(self) -> None:
+        """只保留最近max_history个已结束任务的记录"""
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] not in ACTIVE_STATUSES]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_history + 1)]:
+            self._jobs.pop(job_id)
+            self._done.pop(job_id, None)
+
+    def _persist(self, job: Dict[str, Any]) -> None:
+        """写入外部任务存储"""
+        if self.persist:
+            self.persist(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        return self.fetch(job_id) if self.fetch else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """阻塞等待任务结束并返回任务记录"""
+        with self._lock:
+            done = self._done.get(job_id)
+        if done is not None:
+            done.wait(timeout)
+        return self.get(job_id)
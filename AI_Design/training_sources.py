@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - 训练数据源
+
+训练接口除了在请求体中提交data外，也可以指定 "source": "database"，由训练进程
+直接从CRM数据库（orders、customers、payments、tracking_records等表）读取训练数据：
+
+- 使用服务端游标（named cursor）分块读取，结果集不会一次性传输到客户端
+- 先在同一事务快照中统计行数，按列预分配NumPy数组，分块逐列写入
+- 峰值内存约为最终特征矩阵大小加一个分块，不再经过JSON和Python字典
+
+数据库连接参数来自 DB_Design/database_config.get_env_config（部署时database_config.py
+与服务代码位于同一目录）。
+"""
+
+import os
+import sys
+import time
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from customer_features import CUSTOMER_FEATURES_COLUMNS, CUSTOMER_FEATURES_SQL, refresh_customer_features
+
+logger = logging.getLogger(__name__)
+
+# 开发环境下从仓库的DB_Design目录导入database_config
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DB_Design'))
+
+# 服务端游标每次拉取的行数
+TRAINING_FETCH_SIZE = int(os.getenv('TRAINING_FETCH_SIZE', 20000))
+
+# 列定义: (列名, NumPy类型)，顺序与SELECT一致；可能为NULL的数值列使用float64（NULL读为NaN），
+# 可能为NULL的ID列使用object（保持整数ID）
+Columns = Sequence[Tuple[str, str]]
+
+# ================================================================================
+# 各模型的训练数据查询
+# ================================================================================
+
+# 销售趋势：按月汇总订单，日期取月末，与预测时的月度频率一致
+SALES_TREND_SQL = """
+    SELECT (date_trunc('month', o.order_date) + interval '1 month - 1 day')::timestamp AS date,
+           COUNT(*)::float8 AS order_count,
+           COALESCE(SUM(o.total_amount), 0)::float8 AS total_amount,
+           COUNT(DISTINCT o.customer_id)::float8 AS unique_customers,
+           COALESCE(AVG(o.total_amount), 0)::float8 AS avg_order_value,
+           COALESCE(MAX(m.marketing_spend), 0)::float8 AS marketing_spend
+    FROM orders o
+    LEFT JOIN (
+        SELECT date_trunc('month', stat_date) AS month, SUM(daily_cost) AS marketing_spend
+        FROM campaign_daily_stats
+        GROUP BY 1
+    ) m ON m.month = date_trunc('month', o.order_date)
+    WHERE o.status = 1 AND o.order_status <> 6
+    GROUP BY 1
+    ORDER BY 1
+"""
+SALES_TREND_COLUMNS: Columns = [
+    ('date', 'datetime64[ns]'), ('order_count', 'float64'), ('total_amount', 'float64'),
+    ('unique_customers', 'float64'), ('avg_order_value', 'float64'), ('marketing_spend', 'float64'),
+]
+
+# 多序列销售预测：订单明细及其分组维度（销售人员所属部门、客户来源渠道）
+SALES_SERIES_SQL = """
+    SELECT o.order_date,
+           COALESCE(o.total_amount, 0)::float8 AS total_amount,
+           o.assigned_user_id,
+           u.department_id,
+           c.source_channel
+    FROM orders o
+    LEFT JOIN users u ON u.id = o.assigned_user_id
+    LEFT JOIN customers c ON c.id = o.customer_id
+    WHERE o.status = 1 AND o.order_status <> 6
+"""
+SALES_SERIES_COLUMNS: Columns = [
+    ('order_date', 'datetime64[ns]'), ('total_amount', 'float64'), ('assigned_user_id', 'object'),
+    ('department_id', 'object'), ('source_channel', 'object'),
+]
+
+# 客户行为预测与流失预测共用客户特征表（见customer_features.py），读取前先增量刷新
+CUSTOMER_FEATURE_MODELS = ('customer_behavior', 'churn')
+
+# 推荐：客户购买过的产品，评分为购买次数（上限5）
+RECOMMENDATION_SQL = """
+    SELECT o.customer_id,
+           oi.product_name AS product_id,
+           LEAST(SUM(oi.quantity), 5)::float8 AS rating
+    FROM order_items oi
+    JOIN orders o ON o.id = oi.order_id
+    WHERE o.status = 1 AND o.order_status <> 6
+    GROUP BY o.customer_id, oi.product_name
+"""
+RECOMMENDATION_COLUMNS: Columns = [
+    ('customer_id', 'int64'), ('product_id', 'object'), ('rating', 'float64'),
+]
+
+TRAINING_SOURCES: Dict[str, Tuple[str, Columns]] = {
+    'sales_trend': (SALES_TREND_SQL, SALES_TREND_COLUMNS),
+    'sales_series': (SALES_SERIES_SQL, SALES_SERIES_COLUMNS),
+    'customer_behavior': (CUSTOMER_FEATURES_SQL, CUSTOMER_FEATURES_COLUMNS),
+    'churn': (CUSTOMER_FEATURES_SQL, CUSTOMER_FEATURES_COLUMNS),
+    'recommendation': (RECOMMENDATION_SQL, RECOMMENDATION_COLUMNS),
+}
+
+# ================================================================================
+# 流式读取
+# ================================================================================
+
+def get_connection():
+    """按 database_config.get_env_config 创建PostgreSQL连接"""
+    import psycopg2
+    from database_config import get_env_config
+
+    config = get_env_config()
+    return psycopg2.connect(
+        host=config['host'],
+        port=config['port'],
+        database=config['database'],
+        user=config['username'],
+        password=config['password'],
+        sslmode=config['sslmode']
+    )
+
+def fill_columns(arrays: Dict[str, np.ndarray], columns: Columns, rows: List[tuple], offset: int) -> int:
+    """将一个分块的行数据按列写入预分配数组，返回写入后的偏移量
+
+    整数和布尔列无法表示NULL，出现NULL时抛出ValueError并指明列名（查询中应对这类列做COALESCE，
+    或将列类型声明为float64/object）。
+    """
+    end = min(offset + len(rows), len(next(iter(arrays.values()))))
+    if end <= offset:
+        return offset
+    for (name, _), values in zip(columns, zip(*rows[:end - offset])):
+        array = arrays[name]
+        if array.dtype.kind in 'iub' and None in values:
+            raise ValueError(f"训练数据列{name}的类型为{array.dtype}，但查询结果中存在NULL值")
+        array[offset:end] = values
+    return end
+
+def stream_query(sql: str, columns: Columns, params: Optional[Dict[str, Any]] = None,
+                 fetch_size: int = TRAINING_FETCH_SIZE, connection=None) -> pd.DataFrame:
+    """用服务端游标分块读取查询结果到按列预分配的数组，返回共享这些数组的DataFrame"""
+    start = time.perf_counter()
+    conn = connection or get_connection()
+    try:
+        # 行数统计和数据读取在同一个可重复读快照中进行，保证预分配的行数准确
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM ({sql}) AS training_source", params)
+            n_rows = cursor.fetchone()[0]
+
+        arrays = {name: np.empty(n_rows, dtype=dtype) for name, dtype in columns}
+        offset = 0
+        with conn.cursor(name='training_source') as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                offset = fill_columns(arrays, columns, rows, offset)
+        conn.rollback()
+    finally:
+        if connection is None:
+            conn.close()
+
+    logger.info(f"训练数据读取完成: {n_rows}行, 耗时{time.perf_counter() - start:.2f}s")
+    # 逐列显式指定类型包装为Series：避免DataFrame构造时对object列做类型推断而复制整列
+    return pd.DataFrame({
+        name: pd.Series(arrays[name], dtype=dtype, copy=False) for name, dtype in columns
+    }, copy=False)
+
+def load_training_data(model_name: str, fetch_size: int = TRAINING_FETCH_SIZE) -> pd.DataFrame:
+    """读取指定模型的训练数据"""
+    if model_name not in TRAINING_SOURCES:
+        raise ValueError(f"模型{model_name}不支持从数据库读取训练数据")
+    sql, columns = TRAINING_SOURCES[model_name]
+    if model_name not in CUSTOMER_FEATURE_MODELS:
+        return stream_query(sql, columns, fetch_size=fetch_size)
+
+    conn = get_connection()
+    try:
+        refresh_customer_features(conn)
+        return stream_query(sql, columns, fetch_size=fetch_size, connection=conn)
+    finally:
+        conn.close()
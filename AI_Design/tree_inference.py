@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CRM系统 - 树集成模型的NumPy推理
+
+sklearn的RandomForest预测逐棵树调用，每棵树都有输入校验、线程调度和结果累加的
+Python开销，单行或小批量预测时这些开销远大于实际的树遍历。CompiledForest在训练后
+把整个森林导出为连续的节点数组，用向量化的方式同时遍历所有样本和所有树：
+
+- feature / threshold / left / missing_left / value 按节点存放，所有树的节点拼接在一起，
+  roots为每棵树根节点的位置；每个内部节点的两个子节点相邻存放（右子节点 = left + 1）
+- 叶子节点指向自身、阈值为正无穷，遍历固定执行 max_depth 步，不需要判断是否到达叶子
+- 输入按sklearn的方式转为float32；阈值向下取整到float32（对float32输入，x > 阈值 与
+  x > 向下取整后的阈值 等价），缺失值按 missing_go_to_left 走向，
+  各树结果按树的顺序累加后取平均，预测结果与sklearn逐位一致
+
+节点数组都是普通NumPy数组，随模型一起保存，加载时同样可以内存映射。
+"""
+
+from typing import Any, Optional
+
+import numpy as np
+from sklearn import __version__ as SKLEARN_VERSION
+
+# 每次遍历的样本数：控制 (样本数 x 树数) 中间数组的大小，使其留在CPU缓存中
+TRAVERSAL_BLOCK_SIZE = 256
+
+# sklearn 1.4起分类树的tree_.value保存的是类别比例，predict_proba直接返回；
+# 之前的版本保存加权样本数，在predict_proba中按行归一化
+_NORMALIZE_CLASS_VALUES = tuple(int(part) for part in SKLEARN_VERSION.split('.')[:2]) < (1, 4)
+
+
+class CompiledForest:
+    """导出为节点数组的随机森林（RandomForestClassifier / RandomForestRegressor）"""
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray,
+                 missing_left: np.ndarray, value: np.ndarray, roots: np.ndarray, max_depth: int,
+                 n_features: int, classes: Optional[np.ndarray] = None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.n_features = n_features
+        self.classes_ = classes
+
+    @classmethod
+    def from_sklearn(cls, forest: Any) -> 'CompiledForest':
+        """导出已训练的sklearn随机森林（单输出）"""
+        is_classifier = hasattr(forest, 'classes_')
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        if trees[0].n_outputs != 1:
+            raise ValueError("只支持单输出的随机森林")
+
+        sizes = np.array([tree.node_count for tree in trees])
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        n_nodes = int(sizes.sum())
+        width = forest.n_classes_ if is_classifier else 1
+
+        feature = np.zeros(n_nodes, dtype=np.int32)
+        threshold = np.full(n_nodes, np.inf, dtype=np.float32)
+        left = np.empty(n_nodes, dtype=np.int32)
+        missing_left = np.ones(n_nodes, dtype=bool)
+        value = np.empty((n_nodes, width))
+        max_depth = 0
+
+        for tree, offset in zip(trees, offsets):
+            order = _sibling_order(tree.children_left, tree.children_right)
+            position = np.empty_like(order)
+            position[order] = np.arange(len(order))
+            nodes = slice(offset, offset + len(order))
+
+            is_split = tree.children_left[order] != -1
+            split_nodes = np.flatnonzero(is_split) + offset
+            feature[split_nodes] = tree.feature[order][is_split]
+            threshold[split_nodes] = _floor_float32(tree.threshold[order][is_split])
+            left[nodes] = np.where(is_split, position[tree.children_left[order]] + offset,
+                                   np.arange(len(order)) + offset)
+            tree_missing_left = getattr(tree, 'missing_go_to_left', None)
+            if tree_missing_left is not None:
+                missing_left[split_nodes] = np.asarray(tree_missing_left, dtype=bool)[order][is_split]
+            else:
+                missing_left[split_nodes] = False
+
+            node_value = tree.value[order, 0, :width]
+            if is_classifier and _NORMALIZE_CLASS_VALUES:
+                # 与DecisionTreeClassifier.predict_proba相同的归一化
+                normalizer = node_value.sum(axis=1)[:, np.newaxis]
+                normalizer[normalizer == 0.0] = 1.0
+                node_value = node_value / normalizer
+            value[nodes] = node_value
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(feature, threshold, left, missing_left, value, offsets.astype(np.int32), max_depth,
+                   forest.n_features_in_, forest.classes_ if is_classifier else None)
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """返回每个样本在每棵树中到达的叶子节点（全局节点编号），形状 (样本数, 树数)"""
+        return np.concatenate([self._traverse(block) for block in self._blocks(X)])
+
+    def _blocks(self, X: np.ndarray):
+        """按TRAVERSAL_BLOCK_SIZE切分输入"""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"输入特征数为{X.shape[-1]}，模型需要{self.n_features}个特征")
+        return [X[start:start + TRAVERSAL_BLOCK_SIZE] for start in range(0, max(len(X), 1), TRAVERSAL_BLOCK_SIZE)]
+
+    def _traverse(self, X: np.ndarray) -> np.ndarray:
+        """同时遍历一块样本的所有树"""
+        values = X.ravel()
+        row_offsets = (np.arange(len(X), dtype=np.int32) * self.n_features)[:, np.newaxis]
+        node = np.repeat(self.roots[np.newaxis, :], len(X), axis=0)
+        has_missing = bool(np.isnan(values).any())
+        for _ in range(self.max_depth):
+            x = values.take(row_offsets + self.feature.take(node))
+            go_right = x > self.threshold.take(node)
+            if has_missing:
+                go_right |= np.isnan(x) & ~self.missing_left.take(node)
+            node = self.left.take(node) + go_right
+        return node
+
+    def _average(self, X: np.ndarray) -> np.ndarray:
+        """各树叶子值的平均（按树的顺序累加，与sklearn的累加顺序一致）"""
+        averages = []
+        for block in self._blocks(X):
+            # 严格按树的顺序逐棵累加（np.sum可能使用成对求和，末位会与sklearn不同）
+            leaf_values = self.value[self._traverse(block).T]
+            total = leaf_values[0].copy()
+            for tree_values in leaf_values[1:]:
+                total += tree_values
+            averages.append(total / len(self.roots))
+        return np.concatenate(averages)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """分类森林：各类别的概率，与RandomForestClassifier.predict_proba一致"""
+        if self.classes_ is None:
+            raise ValueError("回归森林不支持predict_proba")
+        return self._average(X)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """分类森林返回类别，回归森林返回预测值"""
+        average = self._average(X)
+        if self.classes_ is None:
+            return average[:, 0]
+        return self.classes_.take(np.argmax(average, axis=1))
+
+
+def _floor_float32(threshold: np.ndarray) -> np.ndarray:
+    """把float64阈值转为不大于它的最大float32"""
+    rounded = threshold.astype(np.float32)
+    above = rounded > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+def _sibling_order(children_left: np.ndarray, children_right: np.ndarray) -> np.ndarray:
+    """按层序重新排列一棵树的节点，使每个节点的左右子节点相邻，返回新顺序下的原节点编号"""
+    order = [0]
+    for node in order:
+        if children_left[node] != -1:
+            order.extend((children_left[node], children_right[node]))
+    return np.array(order, dtype=np.intp)
+
+
+def compile_forest(forest: Any) -> Optional[CompiledForest]:
+    """导出随机森林，未训练或不支持的模型返回None（调用方回退到sklearn预测）"""
+    if not hasattr(forest, 'estimators_'):
+        return None
+    try:
+        return CompiledForest.from_sklearn(forest)
+    except (ValueError, AttributeError):
+        return None
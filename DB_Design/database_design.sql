@@ -280,7 +280,36 @@ CREATE TABLE files (
 );
 
 -- ===============================================
--- 7. 创建索引
+-- 7. AI特征相关表
+-- ===============================================
+
+-- 客户特征表(流失预测、客户行为预测使用，由ML服务按updated_at增量刷新)
+-- 只保存与当前时间无关的聚合值，"距今天数"类特征在读取时计算
+CREATE TABLE ai_customer_features (
+    customer_id BIGINT PRIMARY KEY COMMENT '客户ID',
+    customer_created_at TIMESTAMP COMMENT '客户创建时间',
+    business_type VARCHAR(50) COMMENT '业务类型',
+    source_channel VARCHAR(50) COMMENT '来源渠道',
+    customer_level SMALLINT COMMENT '客户等级',
+    customer_status SMALLINT COMMENT '客户状态',
+    order_count BIGINT NOT NULL DEFAULT 0 COMMENT '有效订单数',
+    total_spent DECIMAL(14,2) NOT NULL DEFAULT 0 COMMENT '累计订单金额',
+    avg_order_value DECIMAL(14,2) COMMENT '平均订单金额',
+    last_order_date TIMESTAMP COMMENT '最近下单时间',
+    payment_delay_avg DOUBLE PRECISION COMMENT '平均付款延迟(天)',
+    contact_count BIGINT NOT NULL DEFAULT 0 COMMENT '跟踪记录数',
+    last_contact_date TIMESTAMP COMMENT '最近跟踪时间',
+    refreshed_at TIMESTAMP NOT NULL COMMENT '刷新时间'
+);
+
+-- 特征刷新状态表(记录各特征表上次增量刷新的时间)
+CREATE TABLE ai_feature_refresh_state (
+    feature_table VARCHAR(100) PRIMARY KEY COMMENT '特征表名',
+    last_refreshed_at TIMESTAMP NOT NULL COMMENT '上次刷新时间'
+);
+
+-- ===============================================
+-- 8. 创建索引
 -- ===============================================
 
 -- 用户表索引
@@ -301,6 +330,7 @@ CREATE INDEX idx_customers_phone ON customers(phone);
 CREATE INDEX idx_customers_assigned_user ON customers(assigned_user_id);
 CREATE INDEX idx_customers_status ON customers(customer_status, status);
 CREATE INDEX idx_customers_created_at ON customers(created_at);
+CREATE INDEX idx_customers_updated_at ON customers(updated_at);
 
 -- 订单表索引
 CREATE INDEX idx_orders_customer ON orders(customer_id);
@@ -308,6 +338,7 @@ CREATE INDEX idx_orders_order_no ON orders(order_no);
 CREATE INDEX idx_orders_assigned_user ON orders(assigned_user_id);
 CREATE INDEX idx_orders_status ON orders(order_status, payment_status);
 CREATE INDEX idx_orders_date ON orders(order_date);
+CREATE INDEX idx_orders_updated_at ON orders(updated_at);
 
 -- 订单商品表索引
 CREATE INDEX idx_order_items_order ON order_items(order_id);
@@ -316,6 +347,7 @@ CREATE INDEX idx_order_items_order ON order_items(order_id);
 CREATE INDEX idx_payments_order ON payments(order_id);
 CREATE INDEX idx_payments_time ON payments(payment_time);
 CREATE INDEX idx_payments_status ON payments(payment_status);
+CREATE INDEX idx_payments_updated_at ON payments(updated_at);
 
 -- 推广活动表索引
 CREATE INDEX idx_campaigns_channel ON campaigns(channel_type);
@@ -329,6 +361,7 @@ CREATE INDEX idx_campaign_stats_campaign_date ON campaign_daily_stats(campaign_i
 CREATE INDEX idx_tracking_target ON tracking_records(target_type, target_id);
 CREATE INDEX idx_tracking_creator ON tracking_records(creator_id);
 CREATE INDEX idx_tracking_created_at ON tracking_records(created_at);
+CREATE INDEX idx_tracking_updated_at ON tracking_records(updated_at);
 
 -- 操作日志表索引
 CREATE INDEX idx_operation_logs_user ON operation_logs(user_id);
@@ -345,7 +378,7 @@ CREATE INDEX idx_files_reference ON files(reference_type, reference_id);
 CREATE INDEX idx_files_hash ON files(file_hash);
 
 -- ===============================================
--- 8. 初始化数据
+-- 9. 初始化数据
 -- ===============================================
 
 -- 插入默认部门
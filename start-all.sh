@@ -105,6 +105,34 @@ else
     echo -e "${YELLOW}⚠️  后端环境不可用，使用前端Mock数据模式${NC}"
 fi
 
+# 启动Python ML服务（如果环境可用）
+# ML_SERVE_MODE=production（默认）使用预fork的Gunicorn工作进程和推理进程池，dev使用Flask开发服务器
+if command -v python3 &> /dev/null && [ -f "AI_Design/python_ml_service.py" ]; then
+    ML_SERVE_MODE=${ML_SERVE_MODE:-production}
+    if [ "$ML_SERVE_MODE" = "production" ] && ! python3 -c "import gunicorn" &> /dev/null; then
+        echo -e "${YELLOW}⚠️  未安装gunicorn，ML服务使用开发模式启动${NC}"
+        ML_SERVE_MODE=dev
+    fi
+    
+    echo -e "${BLUE}🤖 启动ML服务 (${ML_SERVE_MODE})...${NC}"
+    cd AI_Design
+    python3 python_ml_service.py --mode $ML_SERVE_MODE > ../logs/ml-service.log 2>&1 &
+    ML_PID=$!
+    echo $ML_PID > ../logs/ml-service.pid
+    cd ..
+    
+    # 等待模型预加载完成
+    sleep 15
+    
+    if curl -s http://localhost:5001/health > /dev/null; then
+        echo -e "${GREEN}✅ ML服务启动成功: http://localhost:5001${NC}"
+    else
+        echo -e "${YELLOW}⚠️  ML服务启动中，请查看 logs/ml-service.log${NC}"
+    fi
+else
+    echo -e "${YELLOW}⚠️  Python环境不可用，跳过ML服务${NC}"
+fi
+
 echo "================================"
 echo -e "${GREEN}🎉 AI CRM系统启动完成！${NC}"
 echo ""
@@ -122,6 +150,11 @@ if command -v java &> /dev/null && command -v mvn &> /dev/null; then
     echo ""
 fi
 
+if [ -f "logs/ml-service.pid" ]; then
+    echo -e "  🤖 ML服务: ${GREEN}http://localhost:5001${NC}"
+    echo ""
+fi
+
 echo -e "${BLUE}📚 功能模块:${NC}"
 echo "  📊 仪表盘 - 数据统计概览"
 echo "  🎯 线索管理 - 销售线索跟踪"
@@ -160,6 +193,13 @@ monitor_services() {
                 echo -e "${RED}❌ 认证服务异常${NC}"
             fi
         fi
+        
+        # 检查ML服务（如果启动了）
+        if [ -f "logs/ml-service.pid" ]; then
+            if ! curl -s http://localhost:5001/health > /dev/null; then
+                echo -e "${RED}❌ ML服务异常${NC}"
+            fi
+        fi
     done
 }
 
@@ -180,6 +220,12 @@ cleanup() {
         echo -e "${GREEN}✅ 认证服务已停止${NC}"
     fi
     
+    if [ -f "logs/ml-service.pid" ]; then
+        kill $(cat logs/ml-service.pid) 2>/dev/null
+        rm logs/ml-service.pid
+        echo -e "${GREEN}✅ ML服务已停止${NC}"
+    fi
+    
     echo -e "${GREEN}🏁 所有服务已停止${NC}"
     exit 0
 }
@@ -45,6 +45,22 @@ else
     fi
 fi
 
+# 停止ML服务（生产模式下停止Gunicorn master，工作进程和推理进程随之退出）
+if [ -f "logs/ml-service.pid" ]; then
+    echo -e "${BLUE}停止ML服务...${NC}"
+    kill $(cat logs/ml-service.pid) 2>/dev/null
+    rm logs/ml-service.pid
+    echo -e "${GREEN}✅ ML服务已停止${NC}"
+else
+    echo -e "${YELLOW}⚠️  ML服务PID文件不存在${NC}"
+    # 尝试根据端口杀死进程
+    PID=$(lsof -t -i:5001 2>/dev/null)
+    if [ ! -z "$PID" ]; then
+        kill $PID 2>/dev/null
+        echo -e "${GREEN}✅ ML服务已强制停止${NC}"
+    fi
+fi
+
 # 停止所有相关的Node.js和Java进程
 echo -e "${BLUE}清理残留进程...${NC}"
 
@@ -61,5 +77,6 @@ echo ""
 echo -e "${BLUE}📋 已停止的服务:${NC}"
 echo "  🌐 前端开发服务器 (端口 3000)"
 echo "  🔐 认证服务 (端口 50002)"
+echo "  🤖 ML服务 (端口 5001)"
 echo ""
 echo -e "${YELLOW}💡 如需重新启动，请运行: ./start-all.sh${NC}"